@@ -1,131 +1,351 @@
-from flask import Flask, request, jsonify, session, send_from_directory, g
+from flask import Flask, request, jsonify, session, send_from_directory, g, Response, make_response
 import psycopg2
-from psycopg2 import pool
+from psycopg2.extras import execute_values
 import hashlib
 from datetime import datetime, timedelta
-from config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from config import DB_HOST, DB_HOST_DIRETO, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from busca_os import BUSCA_OS_SQL, criar_indices_busca
+from db_connection import ConnectionPool, MIN_POOL_SIZE, MAX_POOL_SIZE, IDLE_PING_TIME, MAX_LIFETIME
 from flask_cors import CORS
 import os
-import pandas as pd
 import unicodedata
 import jwt
 from functools import wraps
 import threading
 import time
 import logging
+import itertools
+import zlib
+import sqlite3
+import tempfile
+import json
+import queue
+import select
+from collections import OrderedDict, deque
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException, NotFound
+
+try:
+    import orjson
+    # Chaves ordenadas como no Flask; datas vão para o default (formato do Flask)
+    OPCOES_ORJSON = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+except ImportError:  # Opcional: sem ele usa o json da biblioteca padrão
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Opcional: sem ele só negocia gzip
+    brotli = None
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+except ImportError:  # Opcional: sem ele /api/metrics responde 501
+    prometheus_client = None
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Métricas Prometheus expostas em /api/metrics. Com PROMETHEUS_MULTIPROC_DIR
+# definido (serve.py faz isso), cada worker grava as suas em arquivos mmap e
+# a coleta soma todos os workers.
+METRICAS_BUCKETS_TEMPO = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+METRICAS_BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+class _MetricaNula:
+    """Substituta sem custo quando prometheus_client não está instalado"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, valor):
+        pass
+
+    def inc(self, valor=1):
+        pass
+
+    def set(self, valor):
+        pass
+
+if prometheus_client is not None:
+    METRICA_REQUISICOES = Counter(
+        'teddy_http_requisicoes_total', 'Requisições atendidas',
+        ['rota', 'metodo', 'status'])
+    METRICA_LATENCIA = Histogram(
+        'teddy_http_latencia_segundos', 'Tempo até a resposta (cabeçalhos, no caso de streams)',
+        ['rota', 'metodo'], buckets=METRICAS_BUCKETS_TEMPO)
+    METRICA_TAMANHO = Histogram(
+        'teddy_http_resposta_bytes', 'Tamanho do corpo enviado (após compressão)',
+        ['rota'], buckets=METRICAS_BUCKETS_BYTES)
+    METRICA_QUERY = Histogram(
+        'teddy_db_query_segundos', 'Tempo de cada execute() no banco',
+        buckets=METRICAS_BUCKETS_TEMPO)
+    METRICA_CHECKOUT = Histogram(
+        'teddy_db_checkout_segundos', 'Tempo para obter uma conexão válida do pool',
+        buckets=METRICAS_BUCKETS_TEMPO)
+    METRICA_POOL = Gauge(
+        'teddy_pool_conexoes', 'Conexões do pool por estado (e checkouts aguardando na fila)',
+        ['estado'], multiprocess_mode='livesum')
+    METRICA_JSON = Histogram(
+        'teddy_json_serializacao_segundos', 'Tempo de serialização das respostas JSON',
+        buckets=METRICAS_BUCKETS_TEMPO)
+else:
+    METRICA_REQUISICOES = METRICA_LATENCIA = METRICA_TAMANHO = _MetricaNula()
+    METRICA_QUERY = METRICA_CHECKOUT = METRICA_POOL = METRICA_JSON = _MetricaNula()
+
+class CursorMedido(psycopg2.extensions.cursor):
+    """Cursor que registra a duração de cada execute() em METRICA_QUERY"""
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            METRICA_QUERY.observe(time.perf_counter() - inicio)
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            METRICA_QUERY.observe(time.perf_counter() - inicio)
+
+class JSONProviderRapido(DefaultJSONProvider):
+    """Serializa com orjson quando disponível.
+
+    Datas continuam no formato do Flask (RFC 822, "Fri, 05 Jan 2024 10:00:00
+    GMT") e Decimal como string: o orjson repassa date/datetime ao mesmo
+    default do DefaultJSONProvider, então a resposta é a mesma com ou sem
+    orjson instalado.
+    """
+
+    default = staticmethod(DefaultJSONProvider.default)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=self.default, option=OPCOES_ORJSON).decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        if orjson is None:
+            resp = super().response(*args, **kwargs)
+        else:
+            obj = self._prepare_response_obj(args, kwargs)
+            dados = orjson.dumps(obj, default=self.default, option=OPCOES_ORJSON)
+            resp = self._app.response_class(dados, mimetype=self.mimetype)
+        METRICA_JSON.observe(time.perf_counter() - inicio)
+        return resp
+
 app = Flask(__name__)
+app.json = JSONProviderRapido(app)
 app.secret_key = 'sua_chave_secreta_aqui'  # Troque por uma chave forte
-CORS(app, supports_credentials=True)
+# Origens do front-end separadas por vírgula (compartilhadas com app_async);
+# sem a variável a origem da requisição é refletida, como sempre foi
+CORS_ORIGENS = [o.strip() for o in os.environ.get('CORS_ORIGENS', '').split(',') if o.strip()]
+CORS_EXPOR = ['ETag', 'Last-Modified', 'Accept-Ranges', 'Content-Range', 'Content-Length']
+CORS(app, origins=CORS_ORIGENS or '*', supports_credentials=True, expose_headers=CORS_EXPOR)
 app.config['SESSION_COOKIE_SAMESITE'] = 'None'
 app.config['SESSION_COOKIE_SECURE'] = True
+# Com um proxy que entende X-Sendfile, a entrega dos PDFs fica com ele
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+
+@app.before_request
+def iniciar_medicao():
+    g.inicio_requisicao = time.perf_counter()
+
+# Registrado antes de comprimir_resposta, portanto roda depois dela e mede o
+# tamanho já comprimido. Rotas usam o padrão (/api/os_detalhe/<int:os_id>)
+# para manter a cardinalidade dos labels limitada.
+@app.after_request
+def registrar_metricas(resp):
+    inicio = g.get('inicio_requisicao')
+    if inicio is None:
+        return resp
+    rota = request.url_rule.rule if request.url_rule else 'sem_rota'
+    METRICA_REQUISICOES.labels(rota, request.method, resp.status_code).inc()
+    METRICA_LATENCIA.labels(rota, request.method).observe(time.perf_counter() - inicio)
+    if resp.content_length is not None:  # Streams sem Content-Length ficam de fora
+        METRICA_TAMANHO.labels(rota).observe(resp.content_length)
+    return resp
 
 # Controle de tentativas de login
-login_attempts = {}
 LOCKOUT_TIME = 300  # segundos
 MAX_ATTEMPTS = 3
+LOGIN_MAX_CHAVES = 100000  # Limite de chaves usuario_ip rastreadas (memória constante)
+# 'memoria' (por processo) ou 'sqlite' (compartilhado entre workers do host);
+# vale também para a lista de tokens revogados no logout
+LOGIN_TENTATIVAS_BACKEND = os.environ.get('LOGIN_TENTATIVAS_BACKEND', 'memoria')
+LOGIN_TENTATIVAS_DB = os.environ.get(
+    'LOGIN_TENTATIVAS_DB', os.path.join(tempfile.gettempdir(), 'teddy_login_tentativas.db'))
 
 SECRET_KEY = 'sua_chave_secreta_super_segura'  # Troque por uma chave forte e secreta
 JWT_EXP_DELTA_SECONDS = 3600  # 1 hora
 
-# Configuração do pool de conexões
-connection_pool = None
-pool_lock = threading.Lock()
+# Cache de tokens já verificados (evita jwt.decode a cada requisição)
+TOKEN_CACHE_MAX_ITENS = 4096
+TOKEN_CACHE_TTL = 300  # segundos; nunca além do exp do próprio token
+
+# Compressão negociada (Accept-Encoding) das respostas JSON
+COMPRESSAO_MIN_BYTES = 1024
+COMPRESSAO_MIMETYPES = ('application/json', 'application/x-ndjson')
+GZIP_NIVEL = 6
+BROTLI_NIVEL = 5
+
+# Paginação/streaming de /api/os_todos
+OS_TODOS_LIMITE_MAX = 1000
+OS_TODOS_ITERSIZE = 500  # Linhas buscadas por ida ao cursor server-side
+
+# Máximo de ids por chamada de /api/os_detalhe em lote
+OS_DETALHE_LOTE_MAX = 500
+
+# Colunas de os_cadastros aceitas em ?fields= (os_todos e os_detalhe)
+OS_CAMPOS = (
+    'id', 'OS', 'Cliente', 'Modelo', 'Entrada', 'Entrada equip.', 'Valor', 'Saída',
+    'Saída equip.', 'Pagamento', 'Vezes', 'Data pagamento 1', 'Data pagamento 2',
+    'Data pagamento 3', 'N° Serie', 'Técnico', 'status', 'avaliacao_tecnica', 'causa_provavel',
+)
+# Máximo de OS por chamada de /api/abrir_os/lote
+ABRIR_OS_LOTE_MAX = 500
+
+class CacheLRU:
+    """Cache em memória LRU + TTL, limitado em número de itens e thread-safe.
+
+    As chaves são tuplas (endpoint, *params) para permitir invalidar uma
+    entrada específica ou todo um endpoint.
+    """
+
+    def __init__(self, max_itens, ttl):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._dados = OrderedDict()  # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirados = 0
+        self.invalidacoes = 0
+
+    def get(self, chave):
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None:
+                self.misses += 1
+                return None
+            expira_em, valor = item
+            if expira_em < time.monotonic():
+                del self._dados[chave]
+                self.expirados += 1
+                self.misses += 1
+                return None
+            self._dados.move_to_end(chave)
+            self.hits += 1
+            return valor
+
+    def set(self, chave, valor, ttl=None):
+        """Armazena o valor; ``ttl`` permite um prazo menor que o padrão"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._dados[chave] = (time.monotonic() + ttl, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+                self.evictions += 1
+
+    def invalidar(self, *chaves):
+        """Remove as chaves exatas informadas"""
+        with self._lock:
+            for chave in chaves:
+                if self._dados.pop(chave, None) is not None:
+                    self.invalidacoes += 1
+
+    def invalidar_endpoint(self, endpoint):
+        """Remove todas as entradas de um endpoint"""
+        with self._lock:
+            for chave in [c for c in self._dados if c[0] == endpoint]:
+                del self._dados[chave]
+                self.invalidacoes += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'itens': len(self._dados),
+                'max_itens': self.max_itens,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirados': self.expirados,
+                'invalidacoes': self.invalidacoes,
+            }
+
+# Cache das leituras mais consultadas pelo front (resumo, detalhe, versões).
+# Escritas deste processo invalidam as entradas afetadas; o TTL limita o
+# atraso para escritas feitas por outros processos (app desktop, workers).
+CACHE_MAX_ITENS = 1024
+CACHE_TTL = 10  # segundos
+response_cache = CacheLRU(CACHE_MAX_ITENS, CACHE_TTL)
+
+def invalidar_cache_os(*os_ids):
+    """Invalida o que depende de os_cadastros após uma escrita.
+
+    Novas OS mudam o resumo e a versão da tabela; alterações/remoções também
+    invalidam o detalhe dos ids informados.
+    """
+    response_cache.invalidar(('versao', 'os_cadastros'), ('resumo_os',))
+    response_cache.invalidar(*[('os_detalhe', os_id) for os_id in os_ids])
+
+db_pool = ConnectionPool(
+    minconn=MIN_POOL_SIZE,
+    maxconn=MAX_POOL_SIZE,
+    idle_ping=IDLE_PING_TIME,
+    max_lifetime=MAX_LIFETIME,
+    host=DB_HOST,
+    port=DB_PORT,
+    database=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    # Configurações para manter conexão viva
+    keepalives=1,
+    keepalives_idle=30,
+    keepalives_interval=10,
+    keepalives_count=5,
+    # Timeout de conexão
+    connect_timeout=10,
+    cursor_factory=CursorMedido
+)
 
 def create_connection_pool():
-    """Cria o pool de conexões com configurações otimizadas"""
-    global connection_pool
-    try:
-        connection_pool = psycopg2.pool.ThreadedConnectionPool(
-            minconn=2,  # Mínimo de conexões
-            maxconn=20,  # Máximo de conexões
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            # Configurações para manter conexão viva
-            keepalives=1,
-            keepalives_idle=30,
-            keepalives_interval=10,
-            keepalives_count=5,
-            # Timeout de conexão
-            connect_timeout=10
-        )
-        logger.info("Pool de conexões criado com sucesso")
-        return True
-    except Exception as e:
-        logger.error(f"Erro ao criar pool de conexões: {str(e)}")
+    """Cria o pool de conexões se ainda não existe"""
+    if db_pool.create_pool() is None:
+        logger.error("Erro ao criar pool de conexões")
         return False
+    return True
+
+def _atualizar_metricas_pool():
+    em_uso, ociosas = db_pool.contagem()
+    METRICA_POOL.labels('em_uso').set(em_uso)
+    METRICA_POOL.labels('ociosa').set(ociosas)
+    METRICA_POOL.labels('aguardando').set(db_pool.aguardando())
 
 def get_db_conn():
-    """Obtém uma conexão do pool com retry automático"""
-    global connection_pool
-    max_retries = 3
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            with pool_lock:
-                if connection_pool is None:
-                    logger.info("Recriando pool de conexões...")
-                    if not create_connection_pool():
-                        raise Exception("Falha ao criar pool de conexões")
-                
-                conn = connection_pool.getconn()
-                
-                # Testa a conexão
-                if conn.closed != 0:
-                    logger.warning("Conexão fechada detectada, obtendo nova conexão...")
-                    connection_pool.putconn(conn, close=True)
-                    conn = connection_pool.getconn()
-                
-                # Teste simples para verificar se a conexão está ativa
-                with conn.cursor() as cur:
-                    cur.execute("SELECT 1")
-                    cur.fetchone()
-                
-                return conn
-                
-        except Exception as e:
-            logger.error(f"Erro ao obter conexão (tentativa {retry_count + 1}): {str(e)}")
-            retry_count += 1
-            
-            if retry_count < max_retries:
-                # Tenta recriar o pool
-                with pool_lock:
-                    if connection_pool:
-                        try:
-                            connection_pool.closeall()
-                        except:
-                            pass
-                        connection_pool = None
-                
-                time.sleep(1)  # Aguarda 1 segundo antes de tentar novamente
-            else:
-                raise Exception(f"Falha ao obter conexão após {max_retries} tentativas")
+    """Obtém uma conexão válida do pool (validação e retry em db_connection)"""
+    inicio = time.perf_counter()
+    conn = db_pool.get_connection()
+    METRICA_CHECKOUT.observe(time.perf_counter() - inicio)
+    _atualizar_metricas_pool()
+    return conn
 
 def return_db_conn(conn):
     """Retorna uma conexão para o pool"""
-    global connection_pool
-    if connection_pool and conn:
-        try:
-            connection_pool.putconn(conn)
-        except Exception as e:
-            logger.error(f"Erro ao retornar conexão: {str(e)}")
+    db_pool.put_connection(conn)
+    _atualizar_metricas_pool()
 
 def close_db_conn(conn):
     """Fecha uma conexão defeituosa"""
-    global connection_pool
-    if connection_pool and conn:
-        try:
-            connection_pool.putconn(conn, close=True)
-        except Exception as e:
-            logger.error(f"Erro ao fechar conexão: {str(e)}")
+    db_pool.discard_connection(conn)
+    _atualizar_metricas_pool()
 
 def health_check():
     """Verifica a saúde do pool de conexões periodicamente"""
@@ -133,28 +353,318 @@ def health_check():
         try:
             time.sleep(300)  # Verifica a cada 5 minutos
             
-            with pool_lock:
-                if connection_pool:
-                    # Testa uma conexão do pool
-                    conn = None
-                    try:
-                        conn = connection_pool.getconn()
-                        with conn.cursor() as cur:
-                            cur.execute("SELECT version()")
-                            cur.fetchone()
-                        connection_pool.putconn(conn)
-                        logger.info("Health check: Pool de conexões OK")
-                    except Exception as e:
-                        logger.error(f"Health check falhou: {str(e)}")
-                        if conn:
-                            connection_pool.putconn(conn, close=True)
+            # Testa uma conexão do pool
+            conn = None
+            try:
+                conn = get_db_conn()
+                with conn.cursor() as cur:
+                    cur.execute("SELECT version()")
+                    cur.fetchone()
+                conn.commit()
+                return_db_conn(conn)
+                logger.info(f"Health check: Pool de conexões OK {db_pool.stats()}")
+            except Exception as e:
+                logger.error(f"Health check falhou: {str(e)}")
+                if conn:
+                    close_db_conn(conn)
                         
         except Exception as e:
             logger.error(f"Erro no health check: {str(e)}")
 
-# Inicia o thread de monitoramento
-health_thread = threading.Thread(target=health_check, daemon=True)
-health_thread.start()
+health_thread = None
+
+def iniciar_worker():
+    """Cria o pool e o thread de health check do processo atual.
+
+    Deve rodar depois do fork (serve.py chama no post_fork do gunicorn), para
+    que cada worker tenha seus próprios sockets e thread de monitoramento.
+    """
+    global health_thread
+    ok = create_connection_pool()
+    if health_thread is None or not health_thread.is_alive():
+        health_thread = threading.Thread(target=health_check, daemon=True)
+        health_thread.start()
+    ouvinte_eventos.iniciar()
+    return ok
+
+# Versão por tabela, incrementada por trigger em qualquer escrita (abrir_os,
+# app desktop, scripts). Permite responder 304 sem refazer a query principal.
+VERSOES_SQL = """
+    CREATE TABLE IF NOT EXISTS tabela_versoes (
+        tabela TEXT PRIMARY KEY,
+        versao BIGINT NOT NULL DEFAULT 0,
+        alterado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+
+    CREATE OR REPLACE FUNCTION incrementar_versao_tabela()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        INSERT INTO tabela_versoes (tabela, versao, alterado_em)
+        VALUES (TG_TABLE_NAME, 1, now())
+        ON CONFLICT (tabela) DO UPDATE
+            SET versao = tabela_versoes.versao + 1, alterado_em = now();
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE TRIGGER os_cadastros_versao
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON os_cadastros
+        FOR EACH STATEMENT EXECUTE FUNCTION incrementar_versao_tabela();
+
+    INSERT INTO tabela_versoes (tabela) VALUES ('os_cadastros') ON CONFLICT DO NOTHING;
+"""
+
+# Eventos de os_cadastros via LISTEN/NOTIFY: cada linha inserida, alterada ou
+# removida gera um NOTIFY com o id e apenas os campos que mudaram. O id do
+# evento vem de uma sequence do banco, então é o mesmo em todos os workers e
+# o Last-Event-ID funciona mesmo que a reconexão caia em outro processo.
+EVENTOS_CANAL = 'os_eventos'
+EVENTOS_SQL = """
+    CREATE SEQUENCE IF NOT EXISTS os_eventos_seq;
+
+    CREATE OR REPLACE FUNCTION notificar_os_evento()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        payload jsonb;
+        campos jsonb;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            payload := jsonb_build_object('op', 'deleted', 'id', OLD.id);
+        ELSIF TG_OP = 'INSERT' THEN
+            payload := jsonb_build_object('op', 'inserted', 'id', NEW.id, 'campos', to_jsonb(NEW));
+        ELSE
+            SELECT COALESCE(jsonb_object_agg(n.key, n.value), '{}'::jsonb) INTO campos
+            FROM jsonb_each(to_jsonb(NEW)) n
+            JOIN jsonb_each(to_jsonb(OLD)) o ON o.key = n.key
+            WHERE n.value IS DISTINCT FROM o.value;
+            IF campos = '{}'::jsonb THEN
+                RETURN NULL;
+            END IF;
+            payload := jsonb_build_object('op', 'updated', 'id', NEW.id, 'campos', campos);
+        END IF;
+        payload := payload || jsonb_build_object('evento_id', nextval('os_eventos_seq'));
+        -- O NOTIFY aceita até 8000 bytes: acima disso envia só os nomes dos campos
+        IF octet_length(payload::text) > 7900 THEN
+            payload := jsonb_build_object(
+                'op', payload->'op', 'id', payload->'id', 'evento_id', payload->'evento_id',
+                'campos_alterados', (SELECT jsonb_agg(k) FROM jsonb_object_keys(payload->'campos') k));
+        END IF;
+        PERFORM pg_notify('os_eventos', payload::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE TRIGGER os_cadastros_eventos
+        AFTER INSERT OR UPDATE OR DELETE ON os_cadastros
+        FOR EACH ROW EXECUTE FUNCTION notificar_os_evento();
+"""
+EVENTOS_FILA_MAX = 1000  # Eventos pendentes por assinante antes de desconectá-lo
+EVENTOS_BUFFER = 500  # Eventos guardados para reenviar após reconexão (Last-Event-ID)
+EVENTOS_HEARTBEAT = 15  # segundos entre comentários de keep-alive
+EVENTOS_MAX_ASSINANTES = 10  # Por processo; cada assinante ocupa uma thread
+
+def inicializar_banco():
+    """Cria a tabela/trigger de versões, o trigger de eventos, pg_trgm e os
+    índices de os_cadastros (idempotente).
+
+    Roda uma vez por inicialização, antes de existirem workers (master do
+    serve.py ou o __main__ abaixo): vários workers executando o mesmo DDL ao
+    mesmo tempo falham com "tuple concurrently updated" e atrasam o boot, e
+    no master o CREATE INDEX CONCURRENTLY não esbarra no timeout dos workers
+    (só o primeiro boot espera o build; depois o IF NOT EXISTS é imediato).
+    Usa uma conexão própria e direta (sem PgBouncer), fechada no fim, para o
+    master não criar o pool. Retorna False se versões/eventos falharem.
+    """
+    conn = None
+    try:
+        conn = psycopg2.connect(
+            host=DB_HOST_DIRETO, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+            connect_timeout=10
+        )
+        with conn.cursor() as cur:
+            cur.execute(VERSOES_SQL)
+            cur.execute(EVENTOS_SQL)
+        conn.commit()
+        # Sem pg_trgm a /api/os_busca falharia até alguém rodar busca_os.py
+        try:
+            conn.autocommit = True
+            criar_indices_busca(conn)
+        except Exception as e:
+            logger.error(f"Erro ao criar pg_trgm/índices de busca: {str(e)}")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao inicializar objetos de banco: {str(e)}")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+class _FilaAssinante(queue.Queue):
+    encerrada = False  # Marcada quando o assinante não acompanha o ritmo
+
+class OuvinteEventosOS:
+    """Uma única conexão LISTEN por processo, repassando os eventos a todos os
+    assinantes SSE e invalidando o cache de respostas afetado."""
+
+    def __init__(self):
+        self._assinantes = set()
+        self._lock = threading.Lock()
+        self._buffer = deque(maxlen=EVENTOS_BUFFER)  # (evento_id, op, dados)
+        self._thread = None
+
+    def iniciar(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, daemon=True)
+                self._thread.start()
+
+    def assinar(self, ultimo_id=None):
+        """Nova fila de eventos (None se o limite de assinantes foi atingido).
+
+        Com ``ultimo_id`` reenfileira os eventos do buffer posteriores a ele.
+        """
+        fila = _FilaAssinante(maxsize=EVENTOS_FILA_MAX)
+        with self._lock:
+            if len(self._assinantes) >= EVENTOS_MAX_ASSINANTES:
+                return None
+            if ultimo_id is not None:
+                for evento in self._buffer:
+                    if evento[0] > ultimo_id:
+                        fila.put_nowait(evento)
+            self._assinantes.add(fila)
+        return fila
+
+    def cancelar(self, fila):
+        with self._lock:
+            self._assinantes.discard(fila)
+
+    def _publicar(self, dados):
+        try:
+            evento = json.loads(dados)
+        except ValueError:
+            logger.error(f"Evento de OS inválido: {dados[:200]}")
+            return
+        if evento.get('op') == 'inserted':
+            invalidar_cache_os()
+        else:
+            invalidar_cache_os(evento.get('id'))
+        if not isinstance(evento.get('evento_id'), int):
+            logger.error(f"Evento de OS sem evento_id (trigger desatualizado?): {dados[:200]}")
+            return
+
+        with self._lock:
+            item = (evento['evento_id'], evento.get('op', 'message'), dados)
+            self._buffer.append(item)
+            for fila in list(self._assinantes):
+                try:
+                    fila.put_nowait(item)
+                except queue.Full:
+                    fila.encerrada = True
+                    self._assinantes.discard(fila)
+
+    def _executar(self):
+        espera = 1
+        while True:
+            conn = None
+            try:
+                # Endpoint direto: no pooler (PgBouncer em modo transação) o
+                # LISTEN não sobrevive entre transações e nada é recebido
+                conn = psycopg2.connect(
+                    host=DB_HOST_DIRETO, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+                    keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=5,
+                    connect_timeout=10
+                )
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN {EVENTOS_CANAL}')
+                logger.info("Ouvinte de eventos de OS conectado")
+                espera = 1
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._publicar(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"Ouvinte de eventos de OS caiu: {str(e)}; reconectando em {espera}s")
+                # Eventos podem ter sido perdidos: descarta o cache inteiro
+                invalidar_cache_os()
+                response_cache.invalidar_endpoint('os_detalhe')
+            finally:
+                if conn:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(espera)
+            espera = min(espera * 2, 60)
+
+ouvinte_eventos = OuvinteEventosOS()
+
+BUSCA_OS_LIMITE_MAX = 200  # Busca textual (SQL e índices em busca_os.py)
+
+def get_versao_tabela(tabela):
+    """Retorna (versao, alterado_em) da tabela, ou None se indisponível"""
+    versao = response_cache.get(('versao', tabela))
+    if versao is not None:
+        return versao
+    conn = None
+    try:
+        conn = get_db_conn()
+        cur = conn.cursor()
+        cur.execute('SELECT versao, alterado_em FROM tabela_versoes WHERE tabela = %s', (tabela,))
+        row = cur.fetchone()
+        cur.close()
+        conn.commit()
+        if row:
+            response_cache.set(('versao', tabela), row)
+        return row
+    except Exception as e:
+        logger.error(f"Erro ao ler versão de {tabela}: {str(e)}")
+        if conn:
+            close_db_conn(conn)
+            conn = None
+        return None
+    finally:
+        if conn:
+            return_db_conn(conn)
+
+def resposta_condicional(tabela):
+    """GET condicional (ETag/Last-Modified) baseado na versão da tabela.
+
+    Se o cliente já tem a versão atual responde 304 sem executar a view;
+    caso contrário anexa os validadores à resposta 200. Só vale para GET/HEAD:
+    a resposta de um POST depende do corpo, que a versão não identifica.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+            versao = get_versao_tabela(tabela)
+            if versao is None:
+                return f(*args, **kwargs)
+            numero, alterado_em = versao
+            etag = f'{tabela}-{numero}'
+            alterado_em = alterado_em.replace(microsecond=0)
+
+            if request.if_none_match:
+                nao_modificado = request.if_none_match.contains_weak(etag)
+            else:
+                ims = request.if_modified_since
+                nao_modificado = ims is not None and alterado_em <= ims
+            if nao_modificado:
+                resp = Response(status=304)
+            else:
+                resp = make_response(f(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag)
+            resp.last_modified = alterado_em
+            resp.headers['Cache-Control'] = 'private, no-cache'
+            return resp
+        return decorated_function
+    return decorator
 
 def hash_password(senha):
     return hashlib.sha256(senha.encode()).hexdigest()
@@ -169,15 +679,35 @@ def gerar_token(usuario, nome, cargo):
     }
     return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
 
+token_cache = CacheLRU(TOKEN_CACHE_MAX_ITENS, TOKEN_CACHE_TTL)
+
+def revogar_token(token):
+    """Revoga um token até o seu exp e o remove do cache de verificados"""
+    try:
+        exp = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])['exp']
+    except jwt.InvalidTokenError:
+        return  # Inválido ou expirado: já seria rejeitado
+    tokens_revogados.revogar(token, exp)
+    token_cache.invalidar(token)
+
 # Função para validar token JWT
 def validar_token(token):
+    # Consultado também nos acertos do cache: a revogação pode ter vindo de
+    # outro worker, cujo logout não limpa o token_cache deste processo
+    if tokens_revogados.revogado(token):
+        return None
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+    # O cache nunca mantém o token além do exp
+    token_cache.set(token, payload, ttl=payload['exp'] - time.time())
+    return payload
 
 def login_required_jwt(f):
     @wraps(f)
@@ -193,6 +723,206 @@ def login_required_jwt(f):
         return f(*args, **kwargs)
     return decorated_function
 
+class TentativasLoginMemoria:
+    """Tentativas de login por chave, em memória do processo.
+
+    As chaves ficam em ordem de última falha, então as expiradas são sempre as
+    primeiras: a limpeza é O(1) amortizado por operação. Além da expiração,
+    o número de chaves é limitado a max_chaves (descarta as mais antigas).
+    """
+
+    def __init__(self, max_tentativas, janela, max_chaves):
+        self.max_tentativas = max_tentativas
+        self.janela = janela
+        self.max_chaves = max_chaves
+        self._dados = OrderedDict()  # chave -> (tentativas, ultima_falha)
+        self._lock = threading.Lock()
+
+    def _expirar(self, agora):
+        while self._dados:
+            _, (_, ultima) = next(iter(self._dados.items()))
+            if agora - ultima < self.janela:
+                break
+            self._dados.popitem(last=False)
+
+    def bloqueio_restante(self, chave):
+        """Segundos restantes de bloqueio (0 se não estiver bloqueado)"""
+        agora = time.monotonic()
+        with self._lock:
+            self._expirar(agora)
+            item = self._dados.get(chave)
+        if item is None or item[0] < self.max_tentativas:
+            return 0
+        return max(1, int(self.janela - (agora - item[1])))
+
+    def registrar_falha(self, chave):
+        agora = time.monotonic()
+        with self._lock:
+            self._expirar(agora)
+            tentativas = self._dados.pop(chave, (0, agora))[0] + 1
+            self._dados[chave] = (tentativas, agora)
+            while len(self._dados) > self.max_chaves:
+                self._dados.popitem(last=False)
+
+    def resetar(self, chave):
+        with self._lock:
+            self._dados.pop(chave, None)
+
+class TentativasLoginSQLite:
+    """Mesma interface de TentativasLoginMemoria, em um arquivo SQLite.
+
+    Compartilhado por todos os workers do mesmo host. As expiradas são
+    removidas por faixa no índice de ultima_falha a cada falha registrada.
+    """
+
+    VERIFICAR_LIMITE_A_CADA = 256  # Falhas entre verificações de max_chaves
+
+    def __init__(self, caminho, max_tentativas, janela, max_chaves):
+        self.caminho = caminho
+        self.max_tentativas = max_tentativas
+        self.janela = janela
+        self.max_chaves = max_chaves
+        self._local = threading.local()
+        self._falhas = 0
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.caminho, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS tentativas_login ('
+                'chave TEXT PRIMARY KEY, tentativas INTEGER NOT NULL, ultima_falha REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_tentativas_login_ultima ON tentativas_login(ultima_falha)'
+            )
+            self._local.conn = conn
+        return conn
+
+    def bloqueio_restante(self, chave):
+        agora = time.time()
+        row = self._conn().execute(
+            'SELECT tentativas, ultima_falha FROM tentativas_login WHERE chave = ? AND ultima_falha > ?',
+            (chave, agora - self.janela)
+        ).fetchone()
+        if row is None or row[0] < self.max_tentativas:
+            return 0
+        return max(1, int(self.janela - (agora - row[1])))
+
+    def registrar_falha(self, chave):
+        agora = time.time()
+        limite = agora - self.janela
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM tentativas_login WHERE ultima_falha <= ?', (limite,))
+            conn.execute(
+                'INSERT INTO tentativas_login (chave, tentativas, ultima_falha) VALUES (?, 1, ?) '
+                'ON CONFLICT(chave) DO UPDATE SET tentativas = tentativas + 1, ultima_falha = excluded.ultima_falha',
+                (chave, agora)
+            )
+            self._falhas += 1
+            if self._falhas % self.VERIFICAR_LIMITE_A_CADA == 0:
+                conn.execute(
+                    'DELETE FROM tentativas_login WHERE chave IN ('
+                    'SELECT chave FROM tentativas_login ORDER BY ultima_falha DESC LIMIT -1 OFFSET ?)',
+                    (self.max_chaves,)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def resetar(self, chave):
+        self._conn().execute('DELETE FROM tentativas_login WHERE chave = ?', (chave,))
+
+def criar_store_tentativas():
+    """Cria o store de tentativas conforme LOGIN_TENTATIVAS_BACKEND"""
+    if LOGIN_TENTATIVAS_BACKEND == 'sqlite':
+        return TentativasLoginSQLite(LOGIN_TENTATIVAS_DB, MAX_ATTEMPTS, LOCKOUT_TIME, LOGIN_MAX_CHAVES)
+    return TentativasLoginMemoria(MAX_ATTEMPTS, LOCKOUT_TIME, LOGIN_MAX_CHAVES)
+
+login_attempts = criar_store_tentativas()
+
+class RevogacoesMemoria:
+    """Tokens revogados (logout) até o exp, em memória do processo"""
+
+    def __init__(self):
+        self._dados = {}  # token -> exp
+        self._lock = threading.Lock()
+
+    def revogar(self, token, exp):
+        agora = time.time()
+        with self._lock:
+            for revogado, expira in list(self._dados.items()):
+                if expira <= agora:
+                    del self._dados[revogado]
+            self._dados[token] = exp
+
+    def revogado(self, token):
+        return token in self._dados
+
+class RevogacoesSQLite:
+    """Mesma interface de RevogacoesMemoria, no arquivo SQLite das tentativas
+    de login (compartilhado por todos os workers do host).
+
+    Guarda só o sha256 do token; os expirados saem a cada nova revogação.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.caminho, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS tokens_revogados ('
+                'token_hash TEXT PRIMARY KEY, expira REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_tokens_revogados_expira ON tokens_revogados(expira)'
+            )
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _hash(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def revogar(self, token, exp):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM tokens_revogados WHERE expira <= ?', (time.time(),))
+            conn.execute(
+                'INSERT OR REPLACE INTO tokens_revogados (token_hash, expira) VALUES (?, ?)',
+                (self._hash(token), exp)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def revogado(self, token):
+        return self._conn().execute(
+            'SELECT 1 FROM tokens_revogados WHERE token_hash = ? AND expira > ?',
+            (self._hash(token), time.time())
+        ).fetchone() is not None
+
+def criar_store_revogacoes():
+    """Cria o store de tokens revogados conforme LOGIN_TENTATIVAS_BACKEND"""
+    if LOGIN_TENTATIVAS_BACKEND == 'sqlite':
+        return RevogacoesSQLite(LOGIN_TENTATIVAS_DB)
+    return RevogacoesMemoria()
+
+tokens_revogados = criar_store_revogacoes()
+
 @app.route('/api/login', methods=['POST'])
 def login():
     data = request.json
@@ -201,16 +931,12 @@ def login():
     usuario = data.get('usuario')
     senha = data.get('senha')
     ip = request.remote_addr
-    now = datetime.now()
     key = f'{usuario}_{ip}'
 
     # Bloqueio por tentativas
-    if key in login_attempts:
-        attempts, last_time = login_attempts[key]
-        if attempts >= MAX_ATTEMPTS and (now - last_time).total_seconds() < LOCKOUT_TIME:
-            return jsonify({'erro': f'Conta bloqueada. Tente novamente em {LOCKOUT_TIME - int((now - last_time).total_seconds())} segundos.'}), 403
-        elif (now - last_time).total_seconds() >= LOCKOUT_TIME:
-            login_attempts[key] = (0, now)
+    restante = login_attempts.bloqueio_restante(key)
+    if restante:
+        return jsonify({'erro': f'Conta bloqueada. Tente novamente em {restante} segundos.'}), 403
 
     conn = None
     try:
@@ -223,17 +949,14 @@ def login():
         if row:
             senha_hash = row[1]
             if senha_hash == senha or senha_hash == hash_password(senha):
-                login_attempts[key] = (0, now)
+                login_attempts.resetar(key)
                 token = gerar_token(usuario, row[2], row[3])
                 if isinstance(token, bytes):
                     token = token.decode('utf-8')
                 return jsonify({'mensagem': 'Login realizado', 'token': token, 'nome': row[2], 'cargo': row[3]})
         
         # Falha
-        if key in login_attempts:
-            login_attempts[key] = (login_attempts[key][0]+1, now)
-        else:
-            login_attempts[key] = (1, now)
+        login_attempts.registrar_falha(key)
         return jsonify({'erro': 'Usuário ou senha inválidos.'}), 401
     except Exception as e:
         if conn:
@@ -245,7 +968,11 @@ def login():
 
 @app.route('/api/resumo_os', methods=['GET'])
 @login_required_jwt
+@resposta_condicional('os_cadastros')
 def resumo_os():
+    resultado = response_cache.get(('resumo_os',))
+    if resultado is not None:
+        return jsonify(resultado)
     conn = None
     try:
         conn = get_db_conn()
@@ -266,10 +993,12 @@ def resumo_os():
                 'id': r[7]
             } for r in rows
         ]
+        response_cache.set(('resumo_os',), resultado)
         return jsonify(resultado)
     except Exception as e:
         if conn:
             close_db_conn(conn)
+            conn = None
         return jsonify({'erro': f'Erro ao buscar OS: {str(e)}'}), 500
     finally:
         if conn:
@@ -297,185 +1026,726 @@ def abrir_os():
                     (cliente, modelo, os_num, entrada, valor, saida, tecnico))
         conn.commit()
         cur.close()
+        invalidar_cache_os()
         return jsonify({'mensagem': 'OS aberta com sucesso!'})
     except Exception as e:
         if conn:
             conn.rollback()
             close_db_conn(conn)
+            conn = None
         return jsonify({'erro': f'Erro ao abrir OS: {str(e)}'}), 500
     finally:
         if conn:
             return_db_conn(conn)
 
+@app.route('/api/abrir_os/lote', methods=['POST'])
+@login_required_jwt
+def abrir_os_lote():
+    """Abre várias OS em uma única transação.
+
+    Recebe uma lista de objetos no mesmo formato de /api/abrir_os. Linhas sem
+    OS, com OS repetida no lote ou já cadastrada são rejeitadas; as demais são
+    inseridas com um único INSERT (execute_values). Retorna o resultado de
+    cada linha na ordem recebida.
+    """
+    data = request.json
+    if not isinstance(data, list) or not data:
+        return jsonify({'erro': 'Envie uma lista de OS'}), 400
+    if len(data) > ABRIR_OS_LOTE_MAX:
+        return jsonify({'erro': f'Máximo de {ABRIR_OS_LOTE_MAX} OS por lote'}), 400
+
+    resultados = [None] * len(data)
+    vistas = set()
+    for i, item in enumerate(data):
+        os_num = item.get('OS') if isinstance(item, dict) else None
+        if os_num in (None, ''):
+            resultados[i] = {'indice': i, 'OS': os_num, 'status': 'rejeitada', 'erro': 'Dados inválidos'}
+        elif str(os_num) in vistas:
+            resultados[i] = {'indice': i, 'OS': os_num, 'status': 'rejeitada', 'erro': 'OS duplicada no lote'}
+        else:
+            vistas.add(str(os_num))
+
+    conn = None
+    try:
+        conn = get_db_conn()
+        cur = conn.cursor()
+        # Uma consulta para todas as OS do lote que já existem
+        cur.execute('SELECT "OS" FROM os_cadastros WHERE "OS"::text = ANY(%s)', (list(vistas),))
+        existentes = {str(r[0]) for r in cur.fetchall()}
+
+        linhas = []
+        for i, item in enumerate(data):
+            if resultados[i] is not None:
+                continue
+            if str(item['OS']) in existentes:
+                resultados[i] = {'indice': i, 'OS': item['OS'], 'status': 'rejeitada', 'erro': 'OS já cadastrada'}
+                continue
+            linhas.append((item.get('Cliente'), item.get('Modelo'), item['OS'], item.get('Entrada'),
+                           item.get('Valor'), item.get('Saida'), item.get('Tecnico')))
+
+        ids = {}
+        if linhas:
+            inseridas = execute_values(
+                cur,
+                'INSERT INTO os_cadastros ("Cliente", "Modelo", "OS", "Entrada", "Valor", "Saída", "Técnico") '
+                'VALUES %s RETURNING id, "OS"',
+                linhas, page_size=len(linhas), fetch=True
+            )
+            ids = {str(os_num): os_id for os_id, os_num in inseridas}
+        conn.commit()
+        cur.close()
+        if linhas:
+            invalidar_cache_os()
+
+        for i, item in enumerate(data):
+            if resultados[i] is None:
+                resultados[i] = {'indice': i, 'OS': item['OS'], 'status': 'criada', 'id': ids.get(str(item['OS']))}
+        criadas = sum(1 for r in resultados if r['status'] == 'criada')
+        return jsonify({'criadas': criadas, 'rejeitadas': len(resultados) - criadas, 'resultados': resultados})
+    except Exception as e:
+        if conn:
+            conn.rollback()
+            close_db_conn(conn)
+            conn = None
+        return jsonify({'erro': f'Erro ao abrir OS em lote: {str(e)}'}), 500
+    finally:
+        if conn:
+            return_db_conn(conn)
+
 @app.route('/api/logout', methods=['POST'])
 def logout():
     session.clear()
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        revogar_token(auth_header.split(' ')[1])
     return jsonify({'mensagem': 'Logout realizado'})
 
+def projecao_os(bruto):
+    """Converte ``?fields=`` (``bruto``) em ``(colunas_sql, campos)`` para o SELECT.
+
+    Sem o parâmetro (None) retorna ``('*', None)``. O id é sempre incluído (é a
+    chave da paginação e do cache). Levanta ValueError se algum campo não
+    estiver em OS_CAMPOS; como só nomes da lista chegam ao SQL, citá-los
+    entre aspas é seguro.
+    """
+    if bruto is None:
+        return '*', None
+    campos = [c.strip() for c in bruto.split(',') if c.strip()]
+    invalidos = [c for c in campos if c not in OS_CAMPOS]
+    if invalidos or not campos:
+        raise ValueError(f"Campos inválidos: {', '.join(invalidos) or '(vazio)'}. "
+                         f"Permitidos: {', '.join(OS_CAMPOS)}")
+    campos = list(dict.fromkeys(['id'] + campos))
+    return ', '.join(f'"{c}"' for c in campos), campos
+
+def _gerar_os_stream(conn, after_id, formato, colunas='*'):
+    """Gera as OS em blocos a partir de um cursor nomeado (server-side).
+
+    O primeiro item (vazio) é produzido logo após o DECLARE, para que erros de
+    query apareçam antes do início da resposta. A conexão é devolvida ao pool
+    ao final (ou ao fechamento) do gerador.
+    """
+    cur = None
+    try:
+        cur = conn.cursor(name='os_todos_stream')
+        cur.itersize = OS_TODOS_ITERSIZE
+        if after_id is None:
+            cur.execute(f'SELECT {colunas} FROM os_cadastros ORDER BY id DESC')
+        else:
+            cur.execute(f'SELECT {colunas} FROM os_cadastros WHERE id < %s ORDER BY id DESC', (after_id,))
+        yield ''
+
+        colnames = None
+        primeiro = True
+        while True:
+            rows = cur.fetchmany(OS_TODOS_ITERSIZE)
+            if colnames is None:
+                colnames = [desc[0] for desc in cur.description or []]
+                if formato == 'json':
+                    yield '['
+                elif formato == 'colunas':
+                    yield '{"colunas":' + app.json.dumps(colnames) + ',"linhas":['
+            if not rows:
+                break
+            if formato == 'colunas':
+                itens = [app.json.dumps(list(r)) for r in rows]
+            else:
+                itens = [app.json.dumps(dict(zip(colnames, r))) for r in rows]
+            if formato == 'ndjson':
+                yield '\n'.join(itens) + '\n'
+            else:
+                yield ('' if primeiro else ',') + ','.join(itens)
+            primeiro = False
+
+        if formato == 'json':
+            yield ']'
+        elif formato == 'colunas':
+            yield ']}'
+        cur.close()
+        cur = None
+        conn.commit()
+        return_db_conn(conn)
+        conn = None
+    except Exception as e:
+        logger.error(f"Erro no streaming de os_todos: {str(e)}")
+        raise
+    finally:
+        # Só chega aqui com conn definido se houve erro ou o cliente desconectou
+        if conn:
+            close_db_conn(conn)
+
 @app.route('/api/os_todos', methods=['GET'])
 @login_required_jwt
+@resposta_condicional('os_cadastros')
 def os_todos():
+    """Lista as OS (id decrescente).
+
+    Sem ``limit`` a tabela é enviada em streaming a partir de um cursor
+    server-side: ``formato=json`` (padrão) gera um array JSON em blocos e
+    ``formato=ndjson`` gera uma OS por linha. Com ``limit`` retorna uma página
+    ``{'dados': [...], 'proximo_after_id': id}``; passe ``after_id`` para obter
+    a página seguinte (``proximo_after_id`` é None na última página).
+    ``formato=colunas`` troca a lista de objetos por
+    ``{'colunas': [...], 'linhas': [[...]]}``, sem repetir os nomes por linha.
+    ``fields=OS,Cliente,...`` restringe as colunas lidas e enviadas.
+    """
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', type=int)
+    formato = request.args.get('formato', 'json')
+    if formato not in ('json', 'ndjson', 'colunas'):
+        return jsonify({'erro': 'Formato inválido. Use json, ndjson ou colunas.'}), 400
+    if limit is not None and not 1 <= limit <= OS_TODOS_LIMITE_MAX:
+        return jsonify({'erro': f'limit deve estar entre 1 e {OS_TODOS_LIMITE_MAX}'}), 400
+    try:
+        colunas, _ = projecao_os(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+
     conn = None
+    if limit is None:
+        try:
+            conn = get_db_conn()
+            gerador = _gerar_os_stream(conn, after_id, formato, colunas)
+            inicio = next(gerador)
+        except Exception as e:
+            logger.error(f"Erro em os_todos: {str(e)}")
+            return jsonify({'erro': f'Erro ao buscar OS: {str(e)}'}), 500
+        mimetype = 'application/x-ndjson' if formato == 'ndjson' else 'application/json'
+        resposta = Response(itertools.chain([inicio], gerador), mimetype=mimetype)
+        resposta.call_on_close(gerador.close)
+        return resposta
+
     try:
         conn = get_db_conn()
         cur = conn.cursor()
-        cur.execute('SELECT * FROM os_cadastros ORDER BY id DESC')
+        if after_id is None:
+            cur.execute(f'SELECT {colunas} FROM os_cadastros ORDER BY id DESC LIMIT %s', (limit,))
+        else:
+            cur.execute(f'SELECT {colunas} FROM os_cadastros WHERE id < %s ORDER BY id DESC LIMIT %s', (after_id, limit))
         colnames = [desc[0] for desc in cur.description]
         rows = cur.fetchall()
         cur.close()
-        logger.info(f"Colunas encontradas: {colnames}")
-        logger.info(f"Número de registros: {len(rows)}")
+        proximo = rows[-1][colnames.index('id')] if len(rows) == limit else None
+        if formato == 'colunas':
+            return jsonify({'colunas': colnames, 'linhas': [list(r) for r in rows], 'proximo_after_id': proximo})
         resultado = [dict(zip(colnames, r)) for r in rows]
-        return jsonify(resultado)
+        return jsonify({'dados': resultado, 'proximo_after_id': proximo})
     except Exception as e:
         logger.error(f"Erro em os_todos: {str(e)}")
         if conn:
             close_db_conn(conn)
+            conn = None
         return jsonify({'erro': f'Erro ao buscar OS: {str(e)}'}), 500
     finally:
         if conn:
             return_db_conn(conn)
 
+def _projetar(detalhe, campos):
+    """Restringe um registro completo (do cache) aos campos pedidos"""
+    if campos is None:
+        return detalhe
+    return {c: detalhe[c] for c in campos if c in detalhe}
+
 @app.route('/api/os_detalhe/<int:os_id>', methods=['GET'])
 @login_required_jwt
+@resposta_condicional('os_cadastros')
 def os_detalhe(os_id):
+    """Detalhe de uma OS; ``?fields=`` restringe as colunas retornadas.
+
+    O cache guarda só o registro completo: com ``fields`` um hit é projetado
+    em memória e um miss busca apenas as colunas pedidas, sem cachear.
+    """
+    try:
+        colunas, campos = projecao_os(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    detalhe = response_cache.get(('os_detalhe', os_id))
+    if detalhe is not None:
+        return jsonify(_projetar(detalhe, campos))
     conn = None
     try:
         conn = get_db_conn()
         cur = conn.cursor()
-        cur.execute('SELECT * FROM os_cadastros WHERE id = %s', (os_id,))
+        cur.execute(f'SELECT {colunas} FROM os_cadastros WHERE id = %s', (os_id,))
         colnames = [desc[0] for desc in cur.description]
         row = cur.fetchone()
         cur.close()
         
         if row:
-            return jsonify(dict(zip(colnames, row)))
+            detalhe = dict(zip(colnames, row))
+            if campos is None:
+                response_cache.set(('os_detalhe', os_id), detalhe)
+            return jsonify(detalhe)
         else:
             return jsonify({'erro': 'OS não encontrada'}), 404
     except Exception as e:
         if conn:
             close_db_conn(conn)
+            conn = None
         return jsonify({'erro': f'Erro ao buscar detalhes da OS: {str(e)}'}), 500
     finally:
         if conn:
             return_db_conn(conn)
 
+def ler_ids_lote(entrada, post=False):
+    """Ids pedidos a /api/os_detalhe, sem repetição e na ordem recebida.
+
+    No GET ``entrada`` é a string ``1,2,3``; no POST é o JSON do corpo, que
+    precisa ser ``{"ids": [...]}`` com inteiros (strings e booleanos são
+    recusados). Levanta ValueError com a mensagem de erro para o cliente.
+    """
+    if post:
+        ids = entrada.get('ids') if isinstance(entrada, dict) else None
+        if not isinstance(ids, list) or not all(
+                isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise ValueError('Corpo inválido. Envie {"ids": [1, 2, 3]} com ids inteiros.')
+    else:
+        try:
+            ids = [int(i) for i in entrada.split(',') if i.strip()]
+        except ValueError:
+            raise ValueError('ids inválidos. Informe uma lista de inteiros.')
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise ValueError('Informe ao menos um id')
+    if len(ids) > OS_DETALHE_LOTE_MAX:
+        raise ValueError(f'Máximo de {OS_DETALHE_LOTE_MAX} ids por chamada')
+    return ids
+
+@app.route('/api/os_detalhe', methods=['GET', 'POST'])
+@login_required_jwt
+@resposta_condicional('os_cadastros')
+def os_detalhe_lote():
+    """Detalhes de várias OS em uma única query.
+
+    GET ``?ids=1,2,3`` ou POST ``{"ids": [1, 2, 3]}`` para listas longas.
+    Retorna ``{'dados': [...], 'nao_encontrados': [...]}`` com os registros
+    na ordem pedida e no mesmo formato de /api/os_detalhe/<id>, inclusive
+    ``?fields=`` (na query string também no POST).
+    """
+    try:
+        colunas, campos = projecao_os(request.args.get('fields'))
+        if request.method == 'POST':
+            ids = ler_ids_lote(request.get_json(silent=True), post=True)
+        else:
+            ids = ler_ids_lote(request.args.get('ids', ''))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+
+    detalhes = {}
+    for os_id in ids:
+        detalhe = response_cache.get(('os_detalhe', os_id))
+        if detalhe is not None:
+            detalhes[os_id] = _projetar(detalhe, campos)
+    faltando = [os_id for os_id in ids if os_id not in detalhes]
+
+    conn = None
+    try:
+        if faltando:
+            conn = get_db_conn()
+            cur = conn.cursor()
+            cur.execute(f'SELECT {colunas} FROM os_cadastros WHERE id = ANY(%s)', (faltando,))
+            colnames = [desc[0] for desc in cur.description]
+            for row in cur.fetchall():
+                detalhe = dict(zip(colnames, row))
+                detalhes[detalhe['id']] = detalhe
+                if campos is None:
+                    response_cache.set(('os_detalhe', detalhe['id']), detalhe)
+            cur.close()
+        return jsonify({
+            'dados': [detalhes[os_id] for os_id in ids if os_id in detalhes],
+            'nao_encontrados': [os_id for os_id in ids if os_id not in detalhes],
+        })
+    except Exception as e:
+        if conn:
+            close_db_conn(conn)
+            conn = None
+        return jsonify({'erro': f'Erro ao buscar detalhes das OS: {str(e)}'}), 500
+    finally:
+        if conn:
+            return_db_conn(conn)
+
+@app.route('/api/os_busca', methods=['GET'])
+@login_required_jwt
+@resposta_condicional('os_cadastros')
+def os_busca():
+    """Busca OS por cliente, modelo, número, série ou técnico.
+
+    ``?q=texto&limit=50&offset=0``; retorna ``{'dados': [...], 'proximo_offset': n}``
+    ordenado por relevância (``proximo_offset`` é None na última página).
+    """
+    q = request.args.get('q', '').strip().lower()
+    limit = request.args.get('limit', 50, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if not q:
+        return jsonify({'erro': 'Informe o termo de busca em ?q='}), 400
+    if not 1 <= limit <= BUSCA_OS_LIMITE_MAX or offset < 0:
+        return jsonify({'erro': f'limit deve estar entre 1 e {BUSCA_OS_LIMITE_MAX} e offset >= 0'}), 400
+    padrao = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+    conn = None
+    try:
+        conn = get_db_conn()
+        cur = conn.cursor()
+        cur.execute(BUSCA_OS_SQL, {'q': q, 'padrao': padrao, 'limit': limit, 'offset': offset})
+        colnames = [desc[0] for desc in cur.description]
+        rows = cur.fetchall()
+        cur.close()
+        resultado = []
+        for r in rows:
+            registro = dict(zip(colnames, r))
+            registro.pop('_rank', None)
+            resultado.append(registro)
+        proximo = offset + limit if len(rows) == limit else None
+        return jsonify({'dados': resultado, 'proximo_offset': proximo})
+    except Exception as e:
+        logger.error(f"Erro em os_busca: {str(e)}")
+        if conn:
+            close_db_conn(conn)
+            conn = None
+        return jsonify({'erro': f'Erro na busca de OS: {str(e)}'}), 500
+    finally:
+        if conn:
+            return_db_conn(conn)
+
+# Pasta com os arquivos (orçamentos em PDF) de cada cliente/OS
+BASE_DIR_OS = 'C:/OS'
+INDICE_INTERVALO_VERIFICACAO = 5  # segundos entre checagens de mtime de uma pasta
+
+def normalizar_nome(s):
+    """Remove acentos, espaços e caixa para comparar nomes de pasta"""
+    return unicodedata.normalize('NFKD', s).encode('ASCII', 'ignore').decode('ASCII').replace(' ', '').lower()
+
+class IndiceArquivosOS:
+    """Índice em memória das pastas de BASE_DIR_OS: nome normalizado -> nome real.
+
+    Cada diretório só é reescaneado quando o seu mtime muda (criar, remover ou
+    renomear entradas altera o mtime da pasta), e o mtime é consultado no
+    máximo uma vez a cada ``intervalo`` segundos. A busca de cliente e OS é
+    então uma consulta a dicionário em vez de um listdir completo.
+    """
+
+    def __init__(self, base_dir, intervalo):
+        self.base_dir = base_dir
+        self.intervalo = intervalo
+        # caminho -> (mtime_ns, verificado_em, {nome_normalizado: nome_real}, [pdfs])
+        self._pastas = {}
+
+    def _entrada(self, caminho):
+        """Entrada do índice para o diretório, reescaneando só se o mtime mudou"""
+        agora = time.monotonic()
+        entrada = self._pastas.get(caminho)
+        if entrada is not None and agora - entrada[1] < self.intervalo:
+            return entrada
+        try:
+            mtime = os.stat(caminho).st_mtime_ns
+            if entrada is not None and entrada[0] == mtime:
+                entrada = (mtime, agora, entrada[2], entrada[3])
+            else:
+                subpastas = {}
+                pdfs = []
+                with os.scandir(caminho) as it:
+                    for item in it:
+                        if item.is_dir():
+                            subpastas.setdefault(normalizar_nome(item.name), item.name)
+                        elif item.name.lower().endswith('.pdf'):
+                            pdfs.append(item.name)
+                entrada = (mtime, agora, subpastas, pdfs)
+        except OSError:
+            self._pastas.pop(caminho, None)
+            return None
+        self._pastas[caminho] = entrada
+        return entrada
+
+    def localizar(self, cliente, os_num):
+        """Caminho da pasta da OS (tolerante a acentos, espaços e caixa) ou None"""
+        base = self._entrada(self.base_dir)
+        if base is None:
+            return None
+        cliente_match = base[2].get(normalizar_nome(cliente))
+        if cliente_match is None:
+            return None
+        cliente_path = os.path.join(self.base_dir, cliente_match)
+        pasta_cliente = self._entrada(cliente_path)
+        if pasta_cliente is None:
+            return None
+        os_match = pasta_cliente[2].get(normalizar_nome(os_num))
+        if os_match is None:
+            return None
+        return os.path.join(cliente_path, os_match)
+
+    def listar_pdfs(self, caminho):
+        entrada = self._entrada(caminho)
+        return list(entrada[3]) if entrada else []
+
+indice_arquivos = IndiceArquivosOS(BASE_DIR_OS, INDICE_INTERVALO_VERIFICACAO)
+
 @app.route('/api/os_arquivos/<cliente>/<os_num>', methods=['GET'])
 @login_required_jwt
 def os_arquivos(cliente, os_num):
-    def normalizar(s):
-        return unicodedata.normalize('NFKD', s).encode('ASCII', 'ignore').decode('ASCII').replace(' ', '').lower()
-    base_dir = 'C:/OS'
-    # Busca tolerante para cliente
-    cliente_dirs = [d for d in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, d))] if os.path.isdir(base_dir) else []
-    cliente_norm = normalizar(cliente)
-    cliente_match = next((d for d in cliente_dirs or [] if normalizar(d) == cliente_norm), None)
-    if not cliente_match:
+    base_path = indice_arquivos.localizar(cliente, os_num)
+    if not base_path:
         return jsonify({'arquivos': []})
-    cliente_path = os.path.join(base_dir, cliente_match)
-    # Busca tolerante para OS
-    os_dirs = [d for d in os.listdir(cliente_path) if os.path.isdir(os.path.join(cliente_path, d))] if os.path.isdir(cliente_path) else []
-    os_norm = normalizar(os_num)
-    os_match = next((d for d in os_dirs or [] if normalizar(d) == os_norm), None)
-    if not os_match:
-        return jsonify({'arquivos': []})
-    base_path = os.path.join(cliente_path, os_match)
-    arquivos = []
-    if os.path.isdir(base_path):
-        for nome in os.listdir(base_path):
-            if nome.lower().endswith(('.pdf')):
-                arquivos.append(nome)
-    return jsonify({'arquivos': arquivos})
+    return jsonify({'arquivos': indice_arquivos.listar_pdfs(base_path)})
 
 @app.route('/api/download_arquivo/<cliente>/<os_num>/<nome_arquivo>', methods=['GET'])
 @login_required_jwt
 def download_arquivo(cliente, os_num, nome_arquivo):
-    base_path = os.path.join('C:/OS', cliente, os_num)
-    if not os.path.isdir(base_path):
+    """Entrega o arquivo com suporte a Range (206), ETag/Last-Modified (304) e
+    wsgi.file_wrapper, que em servidores como o gunicorn usa sendfile()."""
+    base_path = indice_arquivos.localizar(cliente, os_num)
+    if not base_path:
         return jsonify({'erro': 'Arquivo não encontrado'}), 404
     try:
-        return send_from_directory(base_path, nome_arquivo, as_attachment=True)
+        resp = send_from_directory(base_path, nome_arquivo, as_attachment=True,
+                                   conditional=True, etag=True)
+        resp.cache_control.private = True
+        return resp
+    except NotFound:
+        return jsonify({'erro': 'Arquivo não encontrado'}), 404
+    except HTTPException:
+        raise  # 416 Range Not Satisfiable e afins
     except Exception as e:
         return jsonify({'erro': f'Erro ao baixar arquivo: {str(e)}'}), 500
 
-@app.route('/api/grafico_mensal/<int:ano>', methods=['GET'])
-@login_required_jwt
-def grafico_mensal(ano):
+# Receita mensal agregada no banco: extrai ano/mês de "Saída equip." (dd/mm/aaaa
+# ou ISO) e converte "Valor" ("R$ 1.234,56") sem trazer as linhas para o Python.
+# Retorna no máximo 12 linhas por ano pedido.
+RECEITA_MENSAL_SQL = r"""
+    WITH base AS (
+        SELECT
+            "Saída equip."::text AS saida,
+            replace(replace(replace(replace("Valor"::text, 'R$', ''), '.', ''), ',', '.'), ' ', '') AS valor
+        FROM os_cadastros
+        WHERE "Saída equip." IS NOT NULL AND "Valor" IS NOT NULL
+    ), datas AS (
+        SELECT
+            -- dd/mm/aaaa ou aaaa-mm-dd, com '/', '-' ou '.' como separador
+            COALESCE(substring(saida from '^\d{1,2}[/.-]\d{1,2}[/.-](\d{4})'),
+                     substring(saida from '^(\d{4})[/.-]\d{1,2}[/.-]\d{1,2}'))::int AS ano,
+            COALESCE(substring(saida from '^\d{1,2}[/.-](\d{1,2})[/.-]\d{4}'),
+                     substring(saida from '^\d{4}[/.-](\d{1,2})[/.-]\d{1,2}'))::int AS mes,
+            valor
+        FROM base
+    )
+    SELECT ano, mes, SUM(CASE WHEN valor ~ '^-?\d+(\.\d+)?$' THEN valor::numeric ELSE 0 END)
+    FROM datas
+    WHERE ano = ANY(%s) AND mes BETWEEN 1 AND 12
+    GROUP BY ano, mes
+"""
+
+MESES = [str(m).zfill(2) for m in range(1, 13)]
+
+# Receita de cada ano por versão de os_cadastros (a mesma do ETag dos
+# gráficos): a chave muda a cada escrita, o TTL só descarta versões antigas
+RECEITA_CACHE_MAX_ITENS = 256
+RECEITA_CACHE_TTL = 3600  # segundos
+receita_cache = CacheLRU(RECEITA_CACHE_MAX_ITENS, RECEITA_CACHE_TTL)
+
+def receita_por_mes(anos):
+    """Retorna {ano: [valor de jan..dez]} para os anos pedidos.
+
+    A RECEITA_MENSAL_SQL interpreta o texto de todas as linhas, então cada
+    ano fica em cache enquanto a versão da tabela não muda; só os anos ainda
+    não calculados nessa versão vão ao banco, em uma única query.
+    """
+    versao = get_versao_tabela('os_cadastros')
+    numero = versao[0] if versao else None
+    mensal = {}
+    faltantes = []
+    for ano in anos:
+        valores = receita_cache.get(('receita', numero, ano)) if numero is not None else None
+        if valores is None:
+            faltantes.append(ano)
+        else:
+            mensal[ano] = valores
+    if not faltantes:
+        return mensal
+
+    novos = {ano: [0.0] * 12 for ano in faltantes}
     conn = None
     try:
         conn = get_db_conn()
-        df = pd.read_sql('SELECT "Saída equip.", "Valor" FROM os_cadastros', conn)
-        
-        df = df.dropna(subset=["Saída equip.", "Valor"])  # Remove linhas sem data ou valor
-        df['saida'] = pd.to_datetime(df['Saída equip.'], dayfirst=True, errors='coerce')
-        df = df.dropna(subset=['saida'])
-        if df.empty:
-            meses = [str(m).zfill(2) for m in range(1, 13)]
-            valores = [0.0 for _ in range(1, 13)]
-            return jsonify({'meses': meses, 'valores': valores})
-        df['Valor'] = df['Valor'].fillna('0')
-        df['valor_num'] = pd.to_numeric(df['Valor'].astype(str).str.replace('R$', '').str.replace('.', '').str.replace(',', '.'), errors='coerce')
-        df['valor_num'] = df['valor_num'].fillna(0)
-        # Garante que 'saida' é datetime antes de usar .dt
-        if 'saida' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['saida']):
-            df['saida'] = pd.to_datetime(df['saida'], errors='coerce')
-        if 'saida' in df.columns and pd.api.types.is_datetime64_any_dtype(df['saida']):
-            df_year = df[df['saida'].dt.year == ano]
-            mensal = df_year.groupby(df_year['saida'].dt.month)['valor_num'].sum().to_dict()
-        else:
-            mensal = {}
-        meses = [str(m).zfill(2) for m in range(1, 13)]
-        valores = [mensal.get(m, 0.0) for m in range(1, 13)]
-        return jsonify({'meses': meses, 'valores': valores})
-    except Exception as e:
+        cur = conn.cursor()
+        cur.execute(RECEITA_MENSAL_SQL, (faltantes,))
+        for ano, mes, total in cur.fetchall():
+            novos[ano][mes - 1] = float(total or 0)
+        cur.close()
+        conn.commit()
+    except Exception:
         if conn:
             close_db_conn(conn)
-        return jsonify({'erro': f'Erro ao gerar gráfico: {str(e)}'}), 500
+            conn = None
+        raise
     finally:
         if conn:
             return_db_conn(conn)
+    if numero is not None:
+        for ano, valores in novos.items():
+            receita_cache.set(('receita', numero, ano), valores)
+    mensal.update(novos)
+    return mensal
+
+@app.route('/api/grafico_mensal/<int:ano>', methods=['GET'])
+@login_required_jwt
+@resposta_condicional('os_cadastros')
+def grafico_mensal(ano):
+    try:
+        mensal = receita_por_mes([ano])
+        return jsonify({'meses': MESES, 'valores': mensal[ano]})
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao gerar gráfico: {str(e)}'}), 500
 
 @app.route('/api/grafico_comparativo/<int:ano1>/<int:ano2>', methods=['GET'])
 @login_required_jwt
+@resposta_condicional('os_cadastros')
 def grafico_comparativo(ano1, ano2):
-    conn = None
     try:
-        conn = get_db_conn()
-        df = pd.read_sql('SELECT "Saída equip.", "Valor" FROM os_cadastros', conn)
-        
-        df = df.dropna(subset=["Saída equip.", "Valor"])  # Remove linhas sem data ou valor
-        df['saida'] = pd.to_datetime(df['Saída equip.'], dayfirst=True, errors='coerce')
-        df = df.dropna(subset=['saida'])
-        if df.empty:
-            meses = [str(m).zfill(2) for m in range(1, 13)]
-            valores1 = [0.0 for _ in range(1, 13)]
-            valores2 = [0.0 for _ in range(1, 13)]
-            return jsonify({'meses': meses, 'valores1': valores1, 'valores2': valores2})
-        df['Valor'] = df['Valor'].fillna('0')
-        df['valor_num'] = pd.to_numeric(df['Valor'].astype(str).str.replace('R$', '').str.replace('.', '').str.replace(',', '.'), errors='coerce')
-        df['valor_num'] = df['valor_num'].fillna(0)
-        # Garante que 'saida' é datetime antes de usar .dt
-        if 'saida' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['saida']):
-            df['saida'] = pd.to_datetime(df['saida'], errors='coerce')
-        if 'saida' in df.columns and pd.api.types.is_datetime64_any_dtype(df['saida']):
-            df1 = df[df['saida'].dt.year == ano1]
-            df2 = df[df['saida'].dt.year == ano2]
-            mensal1 = df1.groupby(df1['saida'].dt.month)['valor_num'].sum().to_dict()
-            mensal2 = df2.groupby(df2['saida'].dt.month)['valor_num'].sum().to_dict()
-        else:
-            mensal1 = {}
-            mensal2 = {}
-        meses = [str(m).zfill(2) for m in range(1, 13)]
-        valores1 = [mensal1.get(m, 0.0) for m in range(1, 13)]
-        valores2 = [mensal2.get(m, 0.0) for m in range(1, 13)]
-        return jsonify({'meses': meses, 'valores1': valores1, 'valores2': valores2})
+        mensal = receita_por_mes([ano1, ano2])
+        return jsonify({'meses': MESES, 'valores1': mensal[ano1], 'valores2': mensal[ano2]})
     except Exception as e:
-        if conn:
-            close_db_conn(conn)
         return jsonify({'erro': f'Erro ao gerar gráfico comparativo: {str(e)}'}), 500
-    finally:
-        if conn:
-            return_db_conn(conn)
+
+@app.route('/api/grafico_comparativo', methods=['GET'])
+@login_required_jwt
+@resposta_condicional('os_cadastros')
+def grafico_comparativo_anos():
+    """Compara qualquer número de anos: ?anos=2023,2024,2025"""
+    try:
+        anos = sorted({int(a) for a in request.args.get('anos', '').split(',') if a.strip()})
+    except ValueError:
+        return jsonify({'erro': 'Parâmetro anos inválido. Use por exemplo ?anos=2023,2024'}), 400
+    if not anos:
+        return jsonify({'erro': 'Informe ao menos um ano em ?anos='}), 400
+
+    try:
+        mensal = receita_por_mes(anos)
+        return jsonify({'meses': MESES, 'valores': {str(ano): mensal[ano] for ano in anos}})
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao gerar gráfico comparativo: {str(e)}'}), 500
+
+def _comprimir_stream(partes, codificacao):
+    """Comprime incrementalmente uma resposta em streaming"""
+    compressor = brotli.Compressor(quality=BROTLI_NIVEL) if codificacao == 'br' else zlib.compressobj(GZIP_NIVEL, zlib.DEFLATED, 31)
+    comprimir = compressor.process if codificacao == 'br' else compressor.compress
+    for parte in partes:
+        if isinstance(parte, str):
+            parte = parte.encode('utf-8')
+        bloco = comprimir(parte)
+        if bloco:
+            yield bloco
+    yield compressor.finish() if codificacao == 'br' else compressor.flush()
+
+@app.after_request
+def comprimir_resposta(resp):
+    """Comprime respostas JSON/NDJSON com br ou gzip conforme Accept-Encoding"""
+    if (resp.status_code != 200 or resp.mimetype not in COMPRESSAO_MIMETYPES
+            or 'Content-Encoding' in resp.headers or resp.direct_passthrough):
+        return resp
+    opcoes = ['br', 'gzip'] if brotli is not None else ['gzip']
+    codificacao = request.accept_encodings.best_match(opcoes)
+    if codificacao is None:
+        return resp
+
+    if resp.is_streamed:
+        resp.response = _comprimir_stream(resp.response, codificacao)
+        resp.headers.pop('Content-Length', None)
+    else:
+        dados = resp.get_data()
+        if len(dados) < COMPRESSAO_MIN_BYTES:
+            return resp
+        if codificacao == 'br':
+            resp.set_data(brotli.compress(dados, quality=BROTLI_NIVEL))
+        else:
+            resp.set_data(zlib.compress(dados, GZIP_NIVEL, wbits=31))
+    resp.headers['Content-Encoding'] = codificacao
+    resp.vary.add('Accept-Encoding')
+    # A representação comprimida não é byte a byte igual: ETag passa a ser fraco
+    etag, _ = resp.get_etag()
+    if etag:
+        resp.set_etag(etag, weak=True)
+    return resp
+
+@app.route('/api/os_eventos', methods=['GET'])
+def os_eventos():
+    """Server-Sent Events com as alterações de os_cadastros.
+
+    Cada evento tem ``event: inserted|updated|deleted`` e ``data`` com o id e
+    os campos alterados. Como o EventSource do navegador não envia headers,
+    o token também é aceito em ``?token=``.
+    """
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        token = auth_header.split(' ')[1]
+    else:
+        token = request.args.get('token')
+    if not token:
+        return jsonify({'erro': 'Token não fornecido'}), 401
+    payload = validar_token(token)
+    if not payload:
+        return jsonify({'erro': 'Token inválido ou expirado'}), 401
+
+    ouvinte_eventos.iniciar()
+    fila = ouvinte_eventos.assinar(request.headers.get('Last-Event-ID', type=int))
+    if fila is None:
+        return jsonify({'erro': 'Limite de conexões de eventos atingido, tente novamente'}), 503
+
+    def gerar():
+        try:
+            yield 'retry: 3000\n\n'
+            while not fila.encerrada:
+                try:
+                    id_evento, op, dados = fila.get(timeout=EVENTOS_HEARTBEAT)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                yield f'id: {id_evento}\nevent: {op}\ndata: {dados}\n\n'
+        finally:
+            ouvinte_eventos.cancelar(fila)
+
+    resp = Response(gerar(), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    resp.call_on_close(lambda: ouvinte_eventos.cancelar(fila))
+    return resp
+
+@app.route('/api/cache_stats', methods=['GET'])
+@login_required_jwt
+def cache_stats():
+    """Contadores de hit/miss/eviction do cache de respostas"""
+    return jsonify(response_cache.stats())
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Métricas no formato de exposição do Prometheus (sem autenticação, como /api/health)"""
+    if prometheus_client is None:
+        return jsonify({'erro': 'prometheus_client não instalado'}), 501
+    registro = prometheus_client.REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registro = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    return Response(prometheus_client.generate_latest(registro),
+                    content_type=prometheus_client.CONTENT_TYPE_LATEST)
 
 @app.route('/api/health', methods=['GET'])
 def health():
@@ -497,16 +1767,15 @@ def cleanup(error):
     pass
 
 def cleanup_pool():
-    global connection_pool
-    if connection_pool:
-        connection_pool.closeall()
+    db_pool.close_pool()
 
 import atexit
 atexit.register(cleanup_pool)
 
 if __name__ == '__main__':
-    # Inicializa o pool de conexões
-    if not create_connection_pool():
+    inicializar_banco()
+    # Inicializa o pool de conexões e o health check
+    if not iniciar_worker():
         logger.error("Falha ao inicializar o pool de conexões")
         exit(1)
     
@@ -0,0 +1,343 @@
+"""
+Variante ASGI (Quart + psycopg 3 assíncrono) da API de OS.
+
+Serve as mesmas rotas de leitura e login do app.py, com a mesma autenticação
+(JWT, bloqueio por tentativas) e os mesmos formatos de JSON, mas sem prender
+uma thread por requisição durante a ida ao Neon.
+
+Execução:
+    hypercorn app_async:app --bind 0.0.0.0:5000
+"""
+import asyncio
+import logging
+import re
+from functools import wraps
+
+from quart import Quart, request, jsonify, g, Response
+from quart_cors import cors
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+from config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from db_connection import MAX_LIFETIME, MAX_IDLE_TIME
+from app import (
+    JSONProviderRapido, validar_token, gerar_token, hash_password, login_attempts,
+    RECEITA_MENSAL_SQL, MESES, OS_TODOS_LIMITE_MAX, OS_TODOS_ITERSIZE,
+    ler_ids_lote, projecao_os, CORS_ORIGENS, CORS_EXPOR,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+app.json = JSONProviderRapido(app)
+# Mesma política do Flask: credenciais e as origens de CORS_ORIGENS. O
+# quart_cors recusa '*' com credenciais; o padrão casa qualquer origem e a
+# devolve no cabeçalho, como o flask_cors faz
+app = cors(
+    app,
+    allow_origin=CORS_ORIGENS or re.compile(r'.*'),
+    allow_credentials=True,
+    expose_headers=CORS_EXPOR,
+)
+
+# Pool assíncrono: uma conexão só fica ocupada durante a query, não durante
+# toda a requisição, então ASYNC_POOL_MAX atende muito mais clientes simultâneos
+ASYNC_POOL_MIN = 2
+ASYNC_POOL_MAX = 20
+ASYNC_POOL_TIMEOUT = 30  # segundos aguardando uma conexão livre
+
+pool = AsyncConnectionPool(
+    make_conninfo(
+        host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+        keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=5,
+        connect_timeout=10,
+    ),
+    min_size=ASYNC_POOL_MIN,
+    max_size=ASYNC_POOL_MAX,
+    timeout=ASYNC_POOL_TIMEOUT,
+    max_lifetime=MAX_LIFETIME,
+    max_idle=MAX_IDLE_TIME,
+    open=False,
+)
+
+@app.before_serving
+async def abrir_pool():
+    await pool.open()
+    logger.info("Pool assíncrono de conexões aberto")
+
+@app.after_serving
+async def fechar_pool():
+    await pool.close()
+
+def login_required_jwt(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'erro': 'Token não fornecido'}), 401
+        token = auth_header.split(' ')[1]
+        # A lista de revogados pode estar no SQLite: fora do event loop
+        payload = await asyncio.to_thread(validar_token, token)
+        if not payload:
+            return jsonify({'erro': 'Token inválido ou expirado'}), 401
+        g.usuario_jwt = payload  # Disponível na view
+        return await f(*args, **kwargs)
+    return decorated_function
+
+@app.route('/api/login', methods=['POST'])
+async def login():
+    data = await request.get_json(silent=True)
+    if not data:
+        return jsonify({'erro': 'Dados inválidos'}), 400
+    usuario = data.get('usuario')
+    senha = data.get('senha')
+    key = f'{usuario}_{request.remote_addr}'
+
+    # Bloqueio por tentativas (o store pode ser SQLite: fora do event loop)
+    restante = await asyncio.to_thread(login_attempts.bloqueio_restante, key)
+    if restante:
+        return jsonify({'erro': f'Conta bloqueada. Tente novamente em {restante} segundos.'}), 403
+
+    try:
+        async with pool.connection() as conn:
+            cur = await conn.execute('SELECT usuario, senha, nome, cargo FROM usuarios WHERE usuario = %s', (usuario,))
+            row = await cur.fetchone()
+        if row:
+            senha_hash = row[1]
+            if senha_hash == senha or senha_hash == hash_password(senha):
+                await asyncio.to_thread(login_attempts.resetar, key)
+                token = gerar_token(usuario, row[2], row[3])
+                if isinstance(token, bytes):
+                    token = token.decode('utf-8')
+                return jsonify({'mensagem': 'Login realizado', 'token': token, 'nome': row[2], 'cargo': row[3]})
+
+        # Falha
+        await asyncio.to_thread(login_attempts.registrar_falha, key)
+        return jsonify({'erro': 'Usuário ou senha inválidos.'}), 401
+    except Exception as e:
+        return jsonify({'erro': f'Erro no login: {str(e)}'}), 500
+
+@app.route('/api/resumo_os', methods=['GET'])
+@login_required_jwt
+async def resumo_os():
+    try:
+        async with pool.connection() as conn:
+            cur = await conn.execute('SELECT "Cliente", "Modelo", "OS", "Entrada", "Valor", "Saída", "Técnico", id FROM os_cadastros ORDER BY id DESC LIMIT 20')
+            rows = await cur.fetchall()
+        resultado = [
+            {
+                'Cliente': r[0],
+                'Modelo': r[1],
+                'OS': r[2],
+                'Entrada': r[3],
+                'Valor': r[4],
+                'Saida': r[5],
+                'Tecnico': r[6],
+                'id': r[7]
+            } for r in rows
+        ]
+        return jsonify(resultado)
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao buscar OS: {str(e)}'}), 500
+
+async def _devolver_conexao(conn):
+    """Encerra a transação aberta pelo cursor nomeado e devolve a conexão.
+
+    Sem o rollback o pool recebe a conexão INTRANS, avisa e faz ele mesmo o
+    rollback a cada stream.
+    """
+    try:
+        await conn.rollback()
+    except Exception as e:
+        logger.warning(f"Erro ao encerrar transação do stream: {e}")
+    await pool.putconn(conn)
+
+async def _gerar_os_stream(after_id, formato, colunas='*'):
+    """Mesmo streaming de app._gerar_os_stream, com cursor server-side assíncrono.
+
+    A conexão é devolvida ao pool no finally: se o cliente desconecta no meio
+    do stream o Quart fecha o gerador (aclose) e a devolução ainda acontece.
+    """
+    conn = await pool.getconn()
+    try:
+        async with conn.cursor(name='os_todos_stream') as cur:
+            if after_id is None:
+                await cur.execute(f'SELECT {colunas} FROM os_cadastros ORDER BY id DESC')
+            else:
+                await cur.execute(f'SELECT {colunas} FROM os_cadastros WHERE id < %s ORDER BY id DESC', (after_id,))
+            yield ''
+
+            colnames = [desc.name for desc in cur.description or []]
+            if formato == 'json':
+                yield '['
+            elif formato == 'colunas':
+                yield '{"colunas":' + app.json.dumps(colnames) + ',"linhas":['
+            primeiro = True
+            while True:
+                rows = await cur.fetchmany(OS_TODOS_ITERSIZE)
+                if not rows:
+                    break
+                if formato == 'colunas':
+                    itens = [app.json.dumps(list(r)) for r in rows]
+                else:
+                    itens = [app.json.dumps(dict(zip(colnames, r))) for r in rows]
+                if formato == 'ndjson':
+                    yield '\n'.join(itens) + '\n'
+                else:
+                    yield ('' if primeiro else ',') + ','.join(itens)
+                primeiro = False
+            if formato == 'json':
+                yield ']'
+            elif formato == 'colunas':
+                yield ']}'
+    finally:
+        # shield: um segundo cancelamento não pode interromper a devolução
+        await asyncio.shield(_devolver_conexao(conn))
+
+@app.route('/api/os_todos', methods=['GET'])
+@login_required_jwt
+async def os_todos():
+    """Mesmos parâmetros e formatos de app.os_todos (after_id, limit, formato, fields)"""
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', type=int)
+    formato = request.args.get('formato', 'json')
+    if formato not in ('json', 'ndjson', 'colunas'):
+        return jsonify({'erro': 'Formato inválido. Use json, ndjson ou colunas.'}), 400
+    if limit is not None and not 1 <= limit <= OS_TODOS_LIMITE_MAX:
+        return jsonify({'erro': f'limit deve estar entre 1 e {OS_TODOS_LIMITE_MAX}'}), 400
+    try:
+        colunas, _ = projecao_os(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+
+    if limit is None:
+        gerador = _gerar_os_stream(after_id, formato, colunas)
+        try:
+            await gerador.__anext__()
+        except Exception as e:
+            logger.error(f"Erro em os_todos: {str(e)}")
+            return jsonify({'erro': f'Erro ao buscar OS: {str(e)}'}), 500
+        mimetype = 'application/x-ndjson' if formato == 'ndjson' else 'application/json'
+        return Response(gerador, mimetype=mimetype)
+
+    try:
+        async with pool.connection() as conn:
+            if after_id is None:
+                cur = await conn.execute(f'SELECT {colunas} FROM os_cadastros ORDER BY id DESC LIMIT %s', (limit,))
+            else:
+                cur = await conn.execute(f'SELECT {colunas} FROM os_cadastros WHERE id < %s ORDER BY id DESC LIMIT %s', (after_id, limit))
+            colnames = [desc.name for desc in cur.description]
+            rows = await cur.fetchall()
+        proximo = rows[-1][colnames.index('id')] if len(rows) == limit else None
+        if formato == 'colunas':
+            return jsonify({'colunas': colnames, 'linhas': [list(r) for r in rows], 'proximo_after_id': proximo})
+        resultado = [dict(zip(colnames, r)) for r in rows]
+        return jsonify({'dados': resultado, 'proximo_after_id': proximo})
+    except Exception as e:
+        logger.error(f"Erro em os_todos: {str(e)}")
+        return jsonify({'erro': f'Erro ao buscar OS: {str(e)}'}), 500
+
+@app.route('/api/os_detalhe/<int:os_id>', methods=['GET'])
+@login_required_jwt
+async def os_detalhe(os_id):
+    """Detalhe de uma OS; ``?fields=`` restringe as colunas (como em app.os_detalhe)"""
+    try:
+        colunas, _ = projecao_os(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    try:
+        async with pool.connection() as conn:
+            cur = await conn.execute(f'SELECT {colunas} FROM os_cadastros WHERE id = %s', (os_id,))
+            colnames = [desc.name for desc in cur.description]
+            row = await cur.fetchone()
+        if row:
+            return jsonify(dict(zip(colnames, row)))
+        else:
+            return jsonify({'erro': 'OS não encontrada'}), 404
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao buscar detalhes da OS: {str(e)}'}), 500
+
+@app.route('/api/os_detalhe', methods=['GET', 'POST'])
+@login_required_jwt
+async def os_detalhe_lote():
+    """Mesmo contrato de app.os_detalhe_lote (?ids=1,2,3 ou POST {"ids": [...]}, ?fields=)"""
+    try:
+        colunas, _ = projecao_os(request.args.get('fields'))
+        if request.method == 'POST':
+            ids = ler_ids_lote(await request.get_json(silent=True), post=True)
+        else:
+            ids = ler_ids_lote(request.args.get('ids', ''))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+
+    try:
+        async with pool.connection() as conn:
+            cur = await conn.execute(f'SELECT {colunas} FROM os_cadastros WHERE id = ANY(%s)', (ids,))
+            colnames = [desc.name for desc in cur.description]
+            detalhes = {}
+            for row in await cur.fetchall():
+                detalhe = dict(zip(colnames, row))
+                detalhes[detalhe['id']] = detalhe
+        return jsonify({
+            'dados': [detalhes[os_id] for os_id in ids if os_id in detalhes],
+            'nao_encontrados': [os_id for os_id in ids if os_id not in detalhes],
+        })
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao buscar detalhes das OS: {str(e)}'}), 500
+
+async def receita_por_mes(anos):
+    """Versão assíncrona de app.receita_por_mes"""
+    mensal = {ano: [0.0] * 12 for ano in anos}
+    async with pool.connection() as conn:
+        cur = await conn.execute(RECEITA_MENSAL_SQL, (list(anos),))
+        for ano, mes, total in await cur.fetchall():
+            mensal[ano][mes - 1] = float(total or 0)
+    return mensal
+
+@app.route('/api/grafico_mensal/<int:ano>', methods=['GET'])
+@login_required_jwt
+async def grafico_mensal(ano):
+    try:
+        mensal = await receita_por_mes([ano])
+        return jsonify({'meses': MESES, 'valores': mensal[ano]})
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao gerar gráfico: {str(e)}'}), 500
+
+@app.route('/api/grafico_comparativo/<int:ano1>/<int:ano2>', methods=['GET'])
+@login_required_jwt
+async def grafico_comparativo(ano1, ano2):
+    try:
+        mensal = await receita_por_mes([ano1, ano2])
+        return jsonify({'meses': MESES, 'valores1': mensal[ano1], 'valores2': mensal[ano2]})
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao gerar gráfico comparativo: {str(e)}'}), 500
+
+@app.route('/api/grafico_comparativo', methods=['GET'])
+@login_required_jwt
+async def grafico_comparativo_anos():
+    """Compara qualquer número de anos: ?anos=2023,2024,2025"""
+    try:
+        anos = sorted({int(a) for a in request.args.get('anos', '').split(',') if a.strip()})
+    except ValueError:
+        return jsonify({'erro': 'Parâmetro anos inválido. Use por exemplo ?anos=2023,2024'}), 400
+    if not anos:
+        return jsonify({'erro': 'Informe ao menos um ano em ?anos='}), 400
+    try:
+        mensal = await receita_por_mes(anos)
+        return jsonify({'meses': MESES, 'valores': {str(ano): mensal[ano] for ano in anos}})
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao gerar gráfico comparativo: {str(e)}'}), 500
+
+@app.route('/api/health', methods=['GET'])
+async def health():
+    """Endpoint para verificar a saúde da aplicação e do banco"""
+    try:
+        async with pool.connection() as conn:
+            await conn.execute('SELECT 1')
+        return jsonify({'status': 'OK', 'database': 'connected'})
+    except Exception as e:
+        return jsonify({'status': 'ERROR', 'database': 'disconnected', 'error': str(e)}), 500
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
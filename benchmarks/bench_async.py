@@ -0,0 +1,147 @@
+"""
+Benchmark de concorrência: app.py (WSGI, threads) x app_async.py (ASGI).
+
+Os dois servidores devem estar rodando contra o mesmo banco e com orçamento
+de memória equivalente, por exemplo:
+
+    gunicorn -w 2 --threads 8 -b :5001 app:app
+    hypercorn -w 2 -b :5002 app_async:app
+
+O script faz login em cada um, dispara N clientes simultâneos contra o
+endpoint escolhido para cada nível de concorrência e reporta req/s, p50/p95
+e o RSS somado dos processos informados em --pids-* (lido de /proc). O
+endpoint padrão não passa pelo cache de respostas, então toda requisição vai
+ao banco. O resultado é salvo em benchmarks/resultados/ (JSON).
+
+Uso:
+    python benchmarks/bench_async.py --usuario admin --senha 123 \\
+        --sync-url http://localhost:5001 --async-url http://localhost:5002 \\
+        --pids-sync 101,102 --pids-async 201,202 --concorrencia 10,50,200
+"""
+import argparse
+import json
+import os
+import subprocess
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIR_RESULTADOS = os.path.join(RAIZ, 'benchmarks', 'resultados')
+
+
+def rss_mb(pids):
+    """RSS somado dos processos (Linux), em MB"""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for linha in f:
+                    if linha.startswith('VmRSS:'):
+                        total += int(linha.split()[1])
+        except OSError:
+            pass
+    return total / 1024
+
+
+def login(base_url, usuario, senha):
+    req = urllib.request.Request(
+        f'{base_url}/api/login',
+        data=json.dumps({'usuario': usuario, 'senha': senha}).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+    )
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return json.load(resp)['token']
+
+
+def rodar(url, token, concorrencia, duracao):
+    """Dispara `concorrencia` clientes por `duracao` segundos; retorna latências e erros"""
+    latencias = []
+    erros = [0]
+    lock = threading.Lock()
+    fim = time.monotonic() + duracao
+
+    def cliente():
+        req = urllib.request.Request(url, headers={'Authorization': f'Bearer {token}'})
+        while time.monotonic() < fim:
+            inicio = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=60) as resp:
+                    resp.read()
+                with lock:
+                    latencias.append(time.perf_counter() - inicio)
+            except Exception:
+                with lock:
+                    erros[0] += 1
+
+    ts = [threading.Thread(target=cliente) for _ in range(concorrencia)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return sorted(latencias), erros[0]
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sync-url', default='http://localhost:5001')
+    parser.add_argument('--async-url', default='http://localhost:5002')
+    parser.add_argument('--pids-sync', default='')
+    parser.add_argument('--pids-async', default='')
+    parser.add_argument('--usuario', required=True)
+    parser.add_argument('--senha', required=True)
+    parser.add_argument('--endpoint', default='/api/os_todos?limit=100')
+    parser.add_argument('--concorrencia', default='10,50,200')
+    parser.add_argument('--duracao', type=float, default=10.0)
+    args = parser.parse_args()
+
+    alvos = [
+        ('sync', args.sync_url, [int(p) for p in args.pids_sync.split(',') if p]),
+        ('async', args.async_url, [int(p) for p in args.pids_async.split(',') if p]),
+    ]
+    resultados = []
+    print(f"{'servidor':8} {'conc':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'erros':>6} {'RSS MB':>8}")
+    for nome, base_url, pids in alvos:
+        token = login(base_url, args.usuario, args.senha)
+        for concorrencia in [int(c) for c in args.concorrencia.split(',')]:
+            latencias, erros = rodar(base_url + args.endpoint, token, concorrencia, args.duracao)
+            r = {
+                'servidor': nome,
+                'concorrencia': concorrencia,
+                'requisicoes': len(latencias),
+                'erros': erros,
+                'rps': len(latencias) / args.duracao,
+                'p50_ms': percentil(latencias, 0.50) * 1000,
+                'p95_ms': percentil(latencias, 0.95) * 1000,
+                'rss_mb': rss_mb(pids),
+            }
+            resultados.append(r)
+            print(f"{nome:8} {concorrencia:5d} {r['rps']:9.1f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+                  f"{erros:6d} {r['rss_mb']:8.1f}")
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    os.makedirs(DIR_RESULTADOS, exist_ok=True)
+    arquivo = os.path.join(DIR_RESULTADOS, f"async_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(arquivo, 'w', encoding='utf-8') as f:
+        json.dump({
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'endpoint': args.endpoint,
+            'duracao': args.duracao,
+            'resultados': resultados,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"\nResultado salvo em {arquivo}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+"""
+Teste de carga da API (app.py) contra um PostgreSQL local descartável.
+
+1. Sobe um PostgreSQL temporário (initdb/pg_ctl do PATH ou de pg_config
+   --bindir) ou usa --dsn de um banco local já existente. ATENÇÃO: com --dsn
+   as tabelas os_cadastros, usuarios e clientes são recriadas.
+2. Popula os_cadastros, usuarios e clientes com volumes sintéticos.
+3. Inicia a API via serve.py apontando para esse banco (DB_* no ambiente).
+4. Dispara clientes simultâneos contra cada endpoint e reporta req/s e
+   latência p50/p95/p99.
+5. Salva o resultado em benchmarks/resultados/ (JSON) e, com --comparar,
+   mostra a variação em relação a uma execução anterior.
+
+Uso:
+    python benchmarks/bench_carga.py --os 100000 --concorrencia 20 --duracao 15
+    python benchmarks/bench_carga.py --os 1000000 --comparar benchmarks/resultados/anterior.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+import psycopg2
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIR_RESULTADOS = os.path.join(RAIZ, 'benchmarks', 'resultados')
+
+USUARIO = 'bench'
+SENHA = 'bench'
+
+ENDPOINTS_PADRAO = [
+    ('POST', '/api/login'),
+    ('GET', '/api/resumo_os'),
+    ('GET', '/api/os_todos?limit=100'),
+    ('GET', '/api/os_todos'),
+    ('GET', '/api/grafico_mensal/2023'),
+    ('GET', '/api/grafico_comparativo/2022/2023'),
+    ('GET', '/api/grafico_comparativo?anos=2021,2022,2023,2024'),
+]
+
+ESQUEMA_SQL = """
+    DROP TABLE IF EXISTS os_cadastros, usuarios, clientes CASCADE;
+
+    CREATE TABLE os_cadastros (
+        id SERIAL PRIMARY KEY,
+        "OS" TEXT,
+        "Cliente" TEXT,
+        "Modelo" TEXT,
+        "Entrada" TEXT,
+        "Entrada equip." TEXT,
+        "Valor" TEXT,
+        "Saída" TEXT,
+        "Saída equip." TEXT,
+        "Pagamento" TEXT,
+        "Vezes" TEXT,
+        "Data pagamento 1" TEXT,
+        "Data pagamento 2" TEXT,
+        "Data pagamento 3" TEXT,
+        "N° Serie" TEXT,
+        "Técnico" TEXT,
+        status TEXT,
+        avaliacao_tecnica TEXT,
+        causa_provavel TEXT
+    );
+
+    CREATE TABLE usuarios (
+        usuario TEXT PRIMARY KEY,
+        senha TEXT,
+        nome TEXT,
+        cargo TEXT
+    );
+
+    CREATE TABLE clientes (
+        id SERIAL PRIMARY KEY,
+        nome VARCHAR(255) NOT NULL,
+        cpf_cnpj VARCHAR(18),
+        endereco TEXT,
+        bairro VARCHAR(100),
+        numero VARCHAR(20),
+        email VARCHAR(255),
+        nome_contato VARCHAR(255),
+        tel_contato VARCHAR(20),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+# Datas entre 2020 e 2024 em dd/mm/aaaa e valores no formato "R$ 1234,56"
+SEED_OS_SQL = """
+    INSERT INTO os_cadastros (
+        "OS", "Cliente", "Modelo", "Entrada", "Entrada equip.", "Valor", "Saída",
+        "Saída equip.", "Pagamento", "Vezes", "N° Serie", "Técnico", status,
+        avaliacao_tecnica, causa_provavel
+    )
+    SELECT
+        i::text,
+        'Cliente ' || (i %% %(clientes)s),
+        'Modelo ' || (i %% 97),
+        to_char(date '2020-01-01' + (i %% 1800), 'DD/MM/YYYY'),
+        to_char(date '2020-01-01' + (i %% 1800), 'DD/MM/YYYY'),
+        'R$ ' || ((i * 37) %% 5000) || ',' || lpad((i %% 100)::text, 2, '0'),
+        to_char(date '2020-01-05' + (i %% 1800), 'DD/MM/YYYY'),
+        to_char(date '2020-01-05' + (i %% 1800), 'DD/MM/YYYY'),
+        'Pix',
+        '1',
+        'SN' || lpad(i::text, 10, '0'),
+        'Técnico ' || (i %% 12),
+        'Concluída',
+        repeat('Avaliação técnica detalhada. ', 8),
+        repeat('Causa provável. ', 4)
+    FROM generate_series(1, %(os)s) AS i
+"""
+
+SEED_CLIENTES_SQL = """
+    INSERT INTO clientes (nome, cpf_cnpj, endereco, bairro, numero, email, nome_contato, tel_contato)
+    SELECT 'Cliente ' || i, lpad(i::text, 14, '0'), 'Rua ' || i, 'Centro', i::text,
+           'cliente' || i || '@exemplo.com', 'Contato ' || i, '119' || lpad(i::text, 8, '0')
+    FROM generate_series(0, %(clientes)s - 1) AS i
+"""
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def binario_postgres(nome):
+    caminho = shutil.which(nome)
+    if caminho:
+        return caminho
+    pg_config = shutil.which('pg_config')
+    if pg_config:
+        bindir = subprocess.check_output([pg_config, '--bindir'], text=True).strip()
+        candidato = os.path.join(bindir, nome)
+        if os.path.exists(candidato):
+            return candidato
+    raise SystemExit(f"{nome} não encontrado: instale o PostgreSQL ou use --dsn")
+
+
+class PostgresTemporario:
+    """PostgreSQL em um diretório temporário, removido ao final"""
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix='bench_pg_')
+        self.porta = porta_livre()
+
+    def __enter__(self):
+        dados = os.path.join(self.dir, 'dados')
+        subprocess.check_call([binario_postgres('initdb'), '-D', dados, '-U', 'postgres',
+                               '-A', 'trust', '-E', 'UTF8'], stdout=subprocess.DEVNULL)
+        subprocess.check_call([binario_postgres('pg_ctl'), '-D', dados, '-w', '-l',
+                               os.path.join(self.dir, 'pg.log'), '-o',
+                               f'-p {self.porta} -k {self.dir} -c listen_addresses=127.0.0.1',
+                               'start'], stdout=subprocess.DEVNULL)
+        return {'host': '127.0.0.1', 'port': self.porta, 'dbname': 'postgres',
+                'user': 'postgres', 'password': ''}
+
+    def __exit__(self, *exc):
+        subprocess.call([binario_postgres('pg_ctl'), '-D', os.path.join(self.dir, 'dados'),
+                         '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def popular(params, n_os, n_clientes):
+    inicio = time.perf_counter()
+    conn = psycopg2.connect(**params)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(ESQUEMA_SQL)
+            cur.execute(SEED_OS_SQL, {'os': n_os, 'clientes': n_clientes})
+            cur.execute(SEED_CLIENTES_SQL, {'clientes': n_clientes})
+            cur.execute('INSERT INTO usuarios VALUES (%s, %s, %s, %s)',
+                        (USUARIO, hashlib.sha256(SENHA.encode()).hexdigest(), 'Benchmark', 'admin'))
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute('VACUUM ANALYZE')
+    finally:
+        conn.close()
+    print(f"Banco populado: {n_os} OS, {n_clientes} clientes em {time.perf_counter() - inicio:.1f}s")
+
+
+class ServidorAPI:
+    """serve.py em um subprocesso apontando para o banco de teste"""
+
+    def __init__(self, params, workers):
+        self.porta = porta_livre()
+        self.url = f'http://127.0.0.1:{self.porta}'
+        self.env = dict(os.environ, DB_HOST=params['host'], DB_PORT=str(params['port']),
+                        DB_NAME=params['dbname'], DB_USER=params['user'],
+                        DB_PASSWORD=params['password'], PORT=str(self.porta))
+        if workers:
+            self.env['WEB_CONCURRENCY'] = str(workers)
+        self.proc = None
+
+    def __enter__(self):
+        self.proc = subprocess.Popen([sys.executable, os.path.join(RAIZ, 'serve.py')], env=self.env,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        limite = time.monotonic() + 60
+        while time.monotonic() < limite:
+            try:
+                with urllib.request.urlopen(self.url + '/api/health', timeout=2) as resp:
+                    if resp.status == 200:
+                        return self
+            except (urllib.error.URLError, OSError):
+                time.sleep(0.5)
+        self.__exit__()
+        raise SystemExit("A API não respondeu em /api/health")
+
+    def __exit__(self, *exc):
+        if self.proc:
+            self.proc.terminate()
+            self.proc.wait(timeout=60)
+
+
+def requisicao(url, metodo, token):
+    if metodo == 'POST':
+        corpo = json.dumps({'usuario': USUARIO, 'senha': SENHA}).encode('utf-8')
+        return urllib.request.Request(url, data=corpo, headers={'Content-Type': 'application/json'})
+    return urllib.request.Request(url, headers={'Authorization': f'Bearer {token}',
+                                                'Accept-Encoding': 'gzip'})
+
+
+def rodar(url, metodo, token, concorrencia, duracao):
+    """Clientes simultâneos por `duracao` segundos; retorna latências (s) e erros"""
+    latencias = []
+    erros = [0]
+    lock = threading.Lock()
+    fim = time.monotonic() + duracao
+
+    def cliente():
+        while time.monotonic() < fim:
+            inicio = time.perf_counter()
+            try:
+                with urllib.request.urlopen(requisicao(url, metodo, token), timeout=120) as resp:
+                    resp.read()
+                with lock:
+                    latencias.append(time.perf_counter() - inicio)
+            except Exception:
+                with lock:
+                    erros[0] += 1
+
+    ts = [threading.Thread(target=cliente) for _ in range(concorrencia)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return sorted(latencias), erros[0]
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def comparar(atual, arquivo):
+    with open(arquivo, encoding='utf-8') as f:
+        anterior = {r['endpoint']: r for r in json.load(f)['resultados']}
+    print(f"\nComparação com {arquivo}:")
+    for r in atual:
+        base = anterior.get(r['endpoint'])
+        if not base or not base['rps']:
+            continue
+        print(f"{r['endpoint']:55} req/s {(r['rps'] / base['rps'] - 1) * 100:+7.1f}%  "
+              f"p95 {r['p95_ms'] - base['p95_ms']:+8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', help='banco local existente (tabelas serão recriadas)')
+    parser.add_argument('--os', type=int, default=10000, help='quantidade de OS (10k a 1M)')
+    parser.add_argument('--clientes', type=int, default=2000)
+    parser.add_argument('--concorrencia', type=int, default=20)
+    parser.add_argument('--duracao', type=float, default=15.0, help='segundos por endpoint')
+    parser.add_argument('--workers', type=int, help='WEB_CONCURRENCY do serve.py')
+    parser.add_argument('--endpoints', help='lista separada por vírgula (padrão: todos)')
+    parser.add_argument('--comparar', help='arquivo de resultado anterior')
+    args = parser.parse_args()
+
+    endpoints = ENDPOINTS_PADRAO
+    if args.endpoints:
+        escolhidos = set(args.endpoints.split(','))
+        endpoints = [e for e in ENDPOINTS_PADRAO if e[1] in escolhidos]
+
+    if args.dsn:
+        params = psycopg2.extensions.parse_dsn(args.dsn)
+        params.setdefault('host', '127.0.0.1')
+        params.setdefault('port', 5432)
+        params.setdefault('password', '')
+        banco = None
+    else:
+        banco = PostgresTemporario()
+        params = banco.__enter__()
+
+    resultados = []
+    try:
+        popular(params, args.os, args.clientes)
+        with ServidorAPI(params, args.workers) as api:
+            with urllib.request.urlopen(requisicao(api.url + '/api/login', 'POST', None)) as resp:
+                token = json.load(resp)['token']
+            print(f"{'endpoint':55} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'erros':>6}")
+            for metodo, caminho in endpoints:
+                latencias, erros = rodar(api.url + caminho, metodo, token, args.concorrencia, args.duracao)
+                r = {
+                    'endpoint': f'{metodo} {caminho}',
+                    'requisicoes': len(latencias),
+                    'erros': erros,
+                    'rps': len(latencias) / args.duracao,
+                    'p50_ms': percentil(latencias, 0.50) * 1000,
+                    'p95_ms': percentil(latencias, 0.95) * 1000,
+                    'p99_ms': percentil(latencias, 0.99) * 1000,
+                }
+                resultados.append(r)
+                print(f"{r['endpoint']:55} {r['rps']:9.1f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+                      f"{r['p99_ms']:8.1f} {erros:6d}")
+    finally:
+        if banco:
+            banco.__exit__(None, None, None)
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    os.makedirs(DIR_RESULTADOS, exist_ok=True)
+    arquivo = os.path.join(DIR_RESULTADOS, f"carga_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(arquivo, 'w', encoding='utf-8') as f:
+        json.dump({
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'os': args.os,
+            'clientes': args.clientes,
+            'concorrencia': args.concorrencia,
+            'duracao': args.duracao,
+            'workers': args.workers,
+            'resultados': resultados,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"\nResultado salvo em {arquivo}")
+
+    if args.comparar:
+        comparar(resultados, args.comparar)
+
+
+if __name__ == '__main__':
+    main()
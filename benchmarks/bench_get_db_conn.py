@@ -0,0 +1,133 @@
+"""
+Benchmark do checkout de conexões do app.py.
+
+Compara o checkout antigo (SELECT 1 sob o pool_lock global a cada chamada)
+com o atual (validação por idade/último uso) usando um pool falso cujas
+queries dormem RTT segundos, simulando a latência até o Neon.
+
+Uso:
+    python benchmarks/bench_get_db_conn.py --threads 16 --rtt 0.02 --duracao 5
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from psycopg2 import extensions as _ext
+from psycopg2.pool import ThreadedConnectionPool
+
+import app
+
+RTT = 0.02
+
+
+class _Info:
+    transaction_status = _ext.TRANSACTION_STATUS_IDLE
+
+
+class FakeCursor:
+    def execute(self, query, params=None):
+        time.sleep(RTT)
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeConn:
+    info = _Info()
+    autocommit = False
+
+    def __init__(self):
+        self.closed = 0
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor()
+
+    def rollback(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePool(ThreadedConnectionPool):
+    def _connect(self, key=None):
+        conn = FakeConn()
+        if key is not None:
+            self._used[key] = conn
+            self._rused[id(conn)] = key
+        else:
+            self._pool.append(conn)
+        return conn
+
+
+LOCK_GLOBAL = threading.Lock()
+
+
+def get_db_conn_antigo():
+    """Checkout como era antes: SELECT 1 segurando o lock global"""
+    with LOCK_GLOBAL:
+        conn = app.db_pool._pool.getconn()
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.fetchone()
+        return conn
+
+
+def medir(checkout, threads, duracao):
+    """Executa checkout + 1 query + devolução em loop e retorna requisições/s"""
+    total = [0] * threads
+    fim = time.monotonic() + duracao
+
+    def worker(i):
+        while time.monotonic() < fim:
+            conn = checkout()
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")  # a query da própria requisição
+            app.return_db_conn(conn)
+            total[i] += 1
+
+    ts = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return sum(total) / duracao
+
+
+def main():
+    global RTT
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rtt', type=float, default=0.02, help='latência simulada por query (s)')
+    parser.add_argument('--duracao', type=float, default=5.0)
+    args = parser.parse_args()
+    RTT = args.rtt
+
+    app.db_pool._pool = FakePool(args.threads, args.threads)
+    antes = medir(get_db_conn_antigo, args.threads, args.duracao)
+    depois = medir(app.get_db_conn, args.threads, args.duracao)
+
+    print(f"threads={args.threads} rtt={args.rtt * 1000:.0f}ms duracao={args.duracao}s")
+    print(f"antes  (SELECT 1 sob lock): {antes:8.1f} req/s")
+    print(f"depois (validação por idade): {depois:8.1f} req/s")
+    print(f"ganho: {depois / antes:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
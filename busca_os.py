@@ -0,0 +1,96 @@
+"""
+Busca textual em os_cadastros, compartilhada pela API (app.py) e pelo
+desktop (storage_db.search_os).
+
+A expressão precisa ser idêntica nos índices e nas consultas para que o
+Postgres use os índices GIN (trigram para trechos/erros de digitação,
+tsvector para palavras inteiras).
+
+Aqui também fica o índice de expressão usado por storage_db.os_existe.
+
+pg_trgm e os índices são criados por app.inicializar_banco no boot, antes
+dos workers (CREATE INDEX CONCURRENTLY numa tabela grande passaria do
+timeout deles). Para adiantar o build antes de um deploy:
+
+    python busca_os.py
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+BUSCA_OS_EXPR = (
+    """lower(coalesce("Cliente"::text, '') || ' ' || coalesce("Modelo"::text, '') || ' ' || """
+    """coalesce("OS"::text, '') || ' ' || coalesce("N° Serie"::text, '') || ' ' || """
+    """coalesce("Técnico"::text, ''))"""
+)
+
+# Número da OS sem diferenciar maiúsculas/espaços (os_existe e seu índice)
+OS_NUMERO_EXPR = 'lower(trim("OS"::text))'
+
+BUSCA_OS_SQL = f"""
+    SELECT *
+    FROM (
+        SELECT os_cadastros.*,
+               ts_rank(to_tsvector('simple', {BUSCA_OS_EXPR}), plainto_tsquery('simple', %(q)s))
+               + word_similarity(%(q)s, {BUSCA_OS_EXPR}) AS _rank
+        FROM os_cadastros
+        WHERE to_tsvector('simple', {BUSCA_OS_EXPR}) @@ plainto_tsquery('simple', %(q)s)
+           OR {BUSCA_OS_EXPR} LIKE %(padrao)s
+           OR %(q)s <%% {BUSCA_OS_EXPR}
+    ) r
+    ORDER BY _rank DESC, id DESC
+    LIMIT %(limit)s OFFSET %(offset)s
+"""
+
+# nome do índice -> definição (após "ON os_cadastros")
+INDICES_BUSCA_OS = {
+    'idx_os_cadastros_busca_trgm': f"USING gin (({BUSCA_OS_EXPR}) gin_trgm_ops)",
+    'idx_os_cadastros_busca_tsv': f"USING gin (to_tsvector('simple', {BUSCA_OS_EXPR}))",
+    'idx_os_cadastros_os_numero': f"USING btree (({OS_NUMERO_EXPR}))",
+}
+
+def criar_indices_busca(conn) -> None:
+    """Cria pg_trgm e os índices de os_cadastros (idempotente).
+
+    ``conn`` precisa estar em autocommit: CONCURRENTLY não roda dentro de
+    transação. Um CREATE INDEX CONCURRENTLY interrompido deixa o índice
+    INVALID, que o IF NOT EXISTS pularia para sempre; esses são removidos e
+    criados de novo.
+    """
+    with conn.cursor() as cur:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cur.execute(
+            """
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = ANY(%s) AND NOT i.indisvalid
+            """,
+            (list(INDICES_BUSCA_OS),)
+        )
+        for (nome,) in cur.fetchall():
+            logger.warning(f"Índice {nome} inválido (criação interrompida); recriando")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
+        for nome, definicao in INDICES_BUSCA_OS.items():
+            logger.info(f"Criando índice {nome} (se não existir)")
+            cur.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} "
+                f"ON os_cadastros {definicao}"
+            )
+
+if __name__ == '__main__':
+    import psycopg2
+    from config import DB_HOST_DIRETO, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+
+    logging.basicConfig(level=logging.INFO)
+    # Conexão direta (sem PgBouncer): o build pode levar minutos
+    conn = psycopg2.connect(
+        host=DB_HOST_DIRETO, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+        connect_timeout=10
+    )
+    try:
+        conn.autocommit = True
+        criar_indices_busca(conn)
+        logger.info("Índices de busca prontos")
+    finally:
+        conn.close()
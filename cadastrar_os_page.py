@@ -12,7 +12,7 @@ from PyQt6.QtCore import Qt, QDate, QSize, QTimer
 from .dialogs import AutocompleteComboBox
 from openpyxl import load_workbook
 from openpyxl.drawing.image import Image as OpenpyxlImage
-from ..backend.storage_db import load_clientes, load_equipamentos, insert_os, load_tecnicos, insert_tecnico, load_gerentes, insert_gerente, get_os_cadastros, delete_tecnico, delete_gerente
+from ..backend.storage_db import load_clientes, load_equipamentos, insert_os, load_tecnicos, insert_tecnico, load_gerentes, insert_gerente, os_existe, delete_tecnico, delete_gerente
 from ..backend.format_utils import format_brl, CurrencyValidator, parse_currency
 from .equipamentos_page import EquipamentosPage
 from .editar_os_page import EditarOSPage
@@ -672,11 +672,7 @@ class CadastrarOSPage(QWidget):
 
     def _os_ja_existe(self, numero_os):
         """Verifica se a OS já existe no banco (case-insensitive)."""
-        numero_os = (numero_os or '').strip().lower()
-        for registro in get_os_cadastros():
-            if str(registro.get('os', '')).strip().lower() == numero_os:
-                return True
-        return False
+        return os_existe(numero_os)
 
     def _preview(self):
         """Gera pré-visualização dos dados inseridos."""
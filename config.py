@@ -1,6 +1,11 @@
-# Preencha com os dados do seu banco Neon
-DB_HOST = 'ep-cold-sky-a537fwxd-pooler.us-east-2.aws.neon.tech'
-DB_PORT = 5432
-DB_NAME = 'neondb'
-DB_USER = 'neondb_owner'
-DB_PASSWORD = 'npg_91HbcvdzrFLw' 
+import os
+
+# Preencha com os dados do seu banco Neon (as variáveis de ambiente têm prioridade)
+DB_HOST = os.environ.get('DB_HOST', 'ep-cold-sky-a537fwxd-pooler.us-east-2.aws.neon.tech')
+DB_PORT = int(os.environ.get('DB_PORT', 5432))
+DB_NAME = os.environ.get('DB_NAME', 'neondb')
+DB_USER = os.environ.get('DB_USER', 'neondb_owner')
+DB_PASSWORD = os.environ.get('DB_PASSWORD', 'npg_91HbcvdzrFLw')
+
+# Endpoint direto (sem PgBouncer) para LISTEN/NOTIFY, que não funciona no pooler em modo transação
+DB_HOST_DIRETO = os.environ.get('DB_HOST_DIRETO', DB_HOST.replace('-pooler', ''))
\ No newline at end of file
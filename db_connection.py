@@ -1,17 +1,18 @@
 import os
 import logging
 import time
-from typing import Optional, Dict, Any, List, Callable
+from typing import Optional, Dict, Any, List, Callable, Tuple
+from collections import deque
 from contextlib import contextmanager
 from functools import wraps
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-from threading import Lock
+from threading import Event, Lock, Thread
 
 import psycopg2
 from psycopg2 import pool
 from psycopg2.extras import RealDictCursor, RealDictRow
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
 
 # Configuração de logging
 logging.basicConfig(
@@ -23,11 +24,15 @@ logger = logging.getLogger(__name__)
 # Constantes
 MAX_RETRIES = 3
 RETRY_DELAY = 1  # segundos
-MAX_POOL_SIZE = 20
-MIN_POOL_SIZE = 5
-POOL_TIMEOUT = 30
+# Ajuste do pool, compartilhado por desktop e API (sobrescrevível por variável de ambiente)
+MAX_POOL_SIZE = int(os.environ.get('DB_POOL_MAX', 20))  # Também define as threads por worker (serve.py)
+MIN_POOL_SIZE = int(os.environ.get('DB_POOL_MIN', 5))
+POOL_TIMEOUT = 30  # segundos aguardando na fila quando todas as conexões estão em uso
 CONNECTION_TIMEOUT = 10
 MAX_IDLE_TIME = 300  # 5 minutos
+IDLE_PING_TIME = int(os.environ.get('DB_IDLE_PING', 30))  # segundos ociosa antes de exigir um SELECT 1 no checkout
+MAX_LIFETIME = int(os.environ.get('DB_MAX_LIFETIME', 1800))  # segundos até a conexão ser descartada e recriada
+MAINTENANCE_INTERVAL = 60  # segundos entre rodadas de limpeza/reposição em segundo plano
 
 @dataclass(frozen=True)
 class DatabaseConfig:
@@ -50,71 +55,357 @@ class DatabaseConfig:
             f"connect_timeout={CONNECTION_TIMEOUT}"
         )
 
+class PoolTimeoutError(Exception):
+    """Nenhuma conexão foi liberada dentro do prazo de espera na fila"""
+
+class _SemaforoFIFO:
+    """Semáforo com fila de espera por ordem de chegada.
+
+    Uma vaga liberada é entregue diretamente ao primeiro da fila, então quem
+    chega depois não passa na frente de quem já está esperando.
+    """
+
+    def __init__(self, vagas: int):
+        self._vagas = vagas
+        self._fila: deque = deque()
+        self._lock = Lock()
+
+    def acquire(self, timeout: Optional[float]) -> bool:
+        with self._lock:
+            if self._vagas > 0 and not self._fila:
+                self._vagas -= 1
+                return True
+            evento = Event()
+            self._fila.append(evento)
+        if evento.wait(timeout):
+            return True
+        with self._lock:
+            try:
+                self._fila.remove(evento)
+                return False
+            except ValueError:
+                return True  # Recebeu a vaga entre o timeout e o lock
+
+    def release(self) -> None:
+        with self._lock:
+            if self._fila:
+                self._fila.popleft().set()
+            else:
+                self._vagas += 1
+
+    def aguardando(self) -> int:
+        return len(self._fila)
+
 class ConnectionPool:
-    """Gerenciador de pool de conexões com retry e monitoramento"""
+    """Pool de conexões thread-safe com validação, retry e métricas.
+
+    É o único gerenciador de conexões do projeto: o app desktop usa a
+    instância global ``_pool`` (get_conn/put_conn) e a API (app.py) cria a
+    sua com os parâmetros de config.py. Sem ``conn_kwargs`` conecta com
+    DatabaseConfig.
+
+    No checkout a conexão é validada pela idade (``max_lifetime``) e só faz
+    um SELECT 1 quando ficou ociosa mais de ``idle_ping`` segundos. Uma
+    thread de manutenção fecha, uma a uma, as conexões ociosas há mais de
+    ``max_idle`` ou mais velhas que ``max_lifetime`` e repõe as ociosas até
+    ``minconn`` sem bloquear os checkouts. ``on_create`` é chamado (fora do
+    lock) sempre que o pool é criado.
+
+    Com ``maxconn`` conexões em uso o checkout espera em fila (FIFO) por até
+    ``timeout`` segundos em vez de falhar na hora.
+    """
     
-    def __init__(self):
+    def __init__(self, minconn: int = MIN_POOL_SIZE, maxconn: int = MAX_POOL_SIZE,
+                 idle_ping: float = IDLE_PING_TIME, max_lifetime: float = MAX_LIFETIME,
+                 max_idle: float = MAX_IDLE_TIME, max_retries: int = MAX_RETRIES,
+                 timeout: float = POOL_TIMEOUT, on_create: Optional[Callable[[], None]] = None,
+                 **conn_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_ping = idle_ping
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._on_create = on_create
+        self._conn_kwargs = conn_kwargs or dict(
+            dsn=DatabaseConfig.get_connection_string(),
+            keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=5,
+        )
         self._pool: Optional[pool.ThreadedConnectionPool] = None
-        self._lock = Lock()
-        self._last_cleanup = time.time()
+        self._lock = Lock()  # Protege apenas a criação/recriação do pool
+        self._info: Dict[Any, List[float]] = {}  # conn -> [criada_em, ultimo_uso] (monotonic)
+        self._info_lock = Lock()
+        self._parar_manutencao: Optional[Event] = None
+        self._vagas = _SemaforoFIFO(maxconn)  # Uma vaga por conexão que pode estar em uso
+        self._emprestadas: set = set()  # Conexões entregues que ainda ocupam vaga
         self._logger = logging.getLogger(__name__)
+        # Métricas
+        self._checkouts = 0
+        self._espera_total = 0.0
+        self._pings = 0
+        self._descartadas = 0
+        self._recriacoes = 0
+        self._falhas = 0
+        self._expiradas = 0
+        self._repostas = 0
+        self._esperas = 0
+        self._espera_fila_total = 0.0
+        self._espera_fila_max = 0.0
+        self._timeouts = 0
+    
+    def _pool_atual(self) -> pool.ThreadedConnectionPool:
+        """Retorna o pool, criando-o se necessário (único trecho sob o lock)"""
+        pool_atual = self._pool
+        if pool_atual is None:
+            criado = False
+            with self._lock:
+                if self._pool is None:
+                    self._pool = pool.ThreadedConnectionPool(
+                        self.minconn, self.maxconn, **self._conn_kwargs
+                    )
+                    agora = time.monotonic()
+                    with self._info_lock:
+                        for conn in self._pool._pool:
+                            self._info[conn] = [agora, agora]
+                    self._iniciar_manutencao()
+                    self._logger.info("Pool de conexões criado com sucesso")
+                    criado = True
+                pool_atual = self._pool
+            # Fora do lock: o hook usa o próprio pool, e uma falha de checkout
+            # nele chama _recriar, que precisa do mesmo lock
+            if criado and self._on_create:
+                try:
+                    self._on_create()
+                except Exception as e:
+                    self._logger.error(f"Erro na inicialização do pool: {e}")
+        return pool_atual
     
     def create_pool(self) -> Optional[pool.ThreadedConnectionPool]:
         """Cria pool de conexões com retry"""
         last_exception = None
-        for attempt in range(MAX_RETRIES):
+        for attempt in range(self.max_retries):
             try:
-                with self._lock:
-                    if self._pool is None:
-                        self._pool = pool.ThreadedConnectionPool(
-                            MIN_POOL_SIZE,
-                            MAX_POOL_SIZE,
-                            DatabaseConfig.get_connection_string()
-                        )
-                        self._logger.info("Pool de conexões criado com sucesso")
-                    return self._pool
+                return self._pool_atual()
             except Exception as e:
                 last_exception = e
                 wait_time = RETRY_DELAY * (2 ** attempt)  # Backoff exponencial
                 self._logger.warning(
-                    f"Falha ao criar pool (tentativa {attempt + 1}/{MAX_RETRIES}). "
+                    f"Falha ao criar pool (tentativa {attempt + 1}/{self.max_retries}). "
                     f"Tentando novamente em {wait_time}s..."
                 )
                 time.sleep(wait_time)
-        self._logger.error(f"Falha ao criar pool após {MAX_RETRIES} tentativas: {last_exception}")
+        self._logger.error(f"Falha ao criar pool após {self.max_retries} tentativas: {last_exception}")
         return None
     
-    def get_connection(self) -> Optional[Any]:
-        """Obtém conexão do pool com retry e garante que está aberta"""
-        if not self._pool:
-            self._pool = self.create_pool()
-        if not self._pool:
-            return None
+    def _recriar(self) -> None:
+        """Fecha o pool atual para que o próximo checkout crie outro"""
+        with self._lock:
+            self._parar_manutencao_atual()
+            if self._pool is not None:
+                try:
+                    self._pool.closeall()
+                except Exception:
+                    pass
+                self._pool = None
+                self._recriacoes += 1
+        with self._info_lock:
+            self._info.clear()
+        # As vagas não são zeradas: as conexões emprestadas (já fechadas pelo
+        # closeall) liberam a sua na devolução ou no descarte, e quem está no
+        # retry de _obter_valida continua ocupando a vaga que já tinha.
+    
+    def _validar(self, conn: Any) -> bool:
+        """Valida a conexão pela idade e pelo último uso bem-sucedido"""
+        # Status local da libpq: conexão perdida não precisa de ping para ser descartada
+        if conn.closed or conn.info.transaction_status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        agora = time.monotonic()
+        with self._info_lock:
+            criada_em, ultimo_uso = self._info.setdefault(conn, [agora, agora])
+        if agora - criada_em > self.max_lifetime:
+            return False
+        if agora - ultimo_uso > self.idle_ping:
+            try:
+                # Em autocommit o ping é uma única ida ao banco, sem BEGIN nem
+                # transação aberta para o próximo usuário fechar
+                autocommit = conn.autocommit
+                if conn.info.transaction_status == TRANSACTION_STATUS_IDLE:
+                    conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                    cur.fetchone()
+                conn.autocommit = autocommit
+            except Exception:
+                return False
+            with self._info_lock:
+                self._info[conn] = [criada_em, agora]
+                self._pings += 1
+        return True
+    
+    def _descartar(self, pool_atual: pool.ThreadedConnectionPool, conn: Any) -> None:
+        with self._info_lock:
+            self._info.pop(conn, None)
+            self._descartadas += 1
         try:
-            conn = self._pool.getconn()
-            # Verifica se a conexão está fechada
-            if hasattr(conn, 'closed') and conn.closed:
-                self._logger.warning("Conexão obtida do pool estava fechada. Criando nova conexão.")
-                # Tenta criar uma nova conexão manualmente
-                conn = psycopg2.connect(DatabaseConfig.get_connection_string())
-            return conn
+            pool_atual.putconn(conn, close=True)
         except Exception as e:
-            self._logger.error(f"Erro ao obter conexão do pool: {e}")
-            return None
+            self._logger.error(f"Erro ao descartar conexão: {e}")
+    
+    def get_connection(self) -> Any:
+        """Obtém uma conexão válida do pool.
+
+        Conexões fechadas, velhas demais ou que falham no ping são trocadas.
+        Em erro de conexão o pool é recriado e a operação repetida com
+        backoff; com o pool apenas esgotado as conexões em uso são mantidas.
+        Se todas as conexões estão em uso espera na fila por até ``timeout``
+        segundos (PoolTimeoutError) e levanta Exception após ``max_retries``
+        tentativas.
+        """
+        inicio = time.monotonic()
+        if not self._vagas.acquire(0):
+            # Esgotado: entra na fila (quem chegou antes é atendido antes)
+            na_fila = self._vagas.aguardando() + 1
+            obteve = self._vagas.acquire(self.timeout)
+            espera = time.monotonic() - inicio
+            with self._info_lock:
+                self._esperas += 1
+                self._espera_fila_total += espera
+                self._espera_fila_max = max(self._espera_fila_max, espera)
+                if not obteve:
+                    self._timeouts += 1
+            if not obteve:
+                raise PoolTimeoutError(
+                    f"Nenhuma conexão livre em {self.timeout}s ({na_fila} aguardando na fila)"
+                )
+        try:
+            conn = self._obter_valida()
+        except Exception:
+            self._vagas.release()
+            raise
+        with self._info_lock:
+            self._emprestadas.add(conn)
+            self._checkouts += 1
+            self._espera_total += time.monotonic() - inicio
+        return conn
+    
+    def _obter_valida(self) -> Any:
+        """Checkout com validação e retry, já com a vaga garantida"""
+        last_exception = None
+        for attempt in range(self.max_retries):
+            pool_atual = None
+            try:
+                pool_atual = self._pool_atual()
+                conn = pool_atual.getconn()
+                descartes = 0
+                while not self._validar(conn):
+                    self._logger.warning("Conexão inválida ou expirada descartada, obtendo nova conexão...")
+                    self._descartar(pool_atual, conn)
+                    descartes += 1
+                    if descartes > self.maxconn:
+                        raise psycopg2.OperationalError("Nenhuma conexão válida disponível no pool")
+                    conn = pool_atual.getconn()
+                return conn
+            except pool.PoolError as e:
+                last_exception = e
+                if pool_atual is None or pool_atual.closed:
+                    self._recriar()
+            except Exception as e:
+                last_exception = e
+                self._recriar()
+            self._logger.error(f"Erro ao obter conexão (tentativa {attempt + 1}): {last_exception}")
+            if attempt + 1 < self.max_retries:
+                time.sleep(RETRY_DELAY * (2 ** attempt))
+        with self._info_lock:
+            self._falhas += 1
+        raise Exception(f"Falha ao obter conexão após {self.max_retries} tentativas: {last_exception}")
+    
+    def _encerrar_emprestimo(self, conn: Any) -> bool:
+        """Tira a conexão das emprestadas; True se o checkout ainda segurava uma vaga.
+
+        A vaga só é devolvida ao semáforo depois do putconn/close: liberá-la
+        antes acordaria um esperando com o ``_used`` do psycopg2 ainda cheio
+        ("connection pool exhausted"). Tirar do conjunto já aqui evita que um
+        novo checkout da mesma conexão tenha a vaga liberada por este.
+        """
+        with self._info_lock:
+            if conn not in self._emprestadas:
+                return False
+            self._emprestadas.discard(conn)
+            return True
     
     def put_connection(self, conn: Any) -> None:
         """Retorna conexão ao pool"""
-        if not self._pool or not conn:
+        if not conn:
+            return
+        tinha_vaga = self._encerrar_emprestimo(conn)
+        try:
+            self._devolver(conn)
+        finally:
+            if tinha_vaga:
+                self._vagas.release()
+    
+    def _devolver(self, conn: Any) -> None:
+        pool_atual = self._pool
+        if not self._pertence(pool_atual, conn):
+            # Emprestada antes de uma recriação: o pool antigo já a fechou
+            self._fechar_orfa(conn)
             return
             
         try:
-            self._pool.putconn(conn)
+            # Marca o último uso bem-sucedido, evitando ping no próximo checkout
+            if not conn.closed:
+                agora = time.monotonic()
+                with self._info_lock:
+                    info = self._info.get(conn)
+                    if info is not None:
+                        info[1] = agora
+                if info is not None and agora - info[0] > self.max_lifetime:
+                    # Passou da idade enquanto estava em uso: não volta ao pool
+                    with self._info_lock:
+                        self._expiradas += 1
+                    self._descartar(pool_atual, conn)
+                    return
+            pool_atual.putconn(conn)
+            # O pool fecha as conexões que excedem minconn
+            if conn.closed:
+                with self._info_lock:
+                    self._info.pop(conn, None)
         except Exception as e:
             self._logger.error(f"Erro ao retornar conexão ao pool: {e}")
     
+    def discard_connection(self, conn: Any) -> None:
+        """Fecha uma conexão defeituosa em vez de devolvê-la"""
+        if not conn:
+            return
+        tinha_vaga = self._encerrar_emprestimo(conn)
+        try:
+            pool_atual = self._pool
+            if not self._pertence(pool_atual, conn):
+                self._fechar_orfa(conn)
+                return
+            self._descartar(pool_atual, conn)
+        finally:
+            if tinha_vaga:
+                self._vagas.release()
+    
+    @staticmethod
+    def _pertence(pool_atual: Optional[pool.ThreadedConnectionPool], conn: Any) -> bool:
+        """Indica se a conexão foi emprestada pelo pool atual"""
+        return pool_atual is not None and id(conn) in pool_atual._rused
+    
+    def _fechar_orfa(self, conn: Any) -> None:
+        with self._info_lock:
+            self._info.pop(conn, None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+    
     def close_pool(self) -> None:
         """Fecha pool de conexões"""
         with self._lock:
+            self._parar_manutencao_atual()
             if self._pool:
                 try:
                     self._pool.closeall()
@@ -123,35 +414,152 @@ class ConnectionPool:
                     self._logger.error(f"Erro ao fechar pool: {e}")
                 finally:
                     self._pool = None
+        with self._info_lock:
+            self._info.clear()
     
-    def cleanup_idle_connections(self) -> None:
-        """Limpa conexões ociosas"""
-        now = time.time()
-        if now - self._last_cleanup < MAX_IDLE_TIME:
-            return
-            
-        self._last_cleanup = now
-        with self._lock:
-            if self._pool:
+    def cleanup_idle_connections(self) -> int:
+        """Fecha as conexões ociosas vencidas, uma a uma.
+
+        Só são consideradas as conexões paradas no pool: ociosas há mais de
+        ``max_idle`` ou criadas há mais de ``max_lifetime``. As em uso nunca
+        são tocadas (as que vencerem são descartadas na devolução). Retorna
+        quantas conexões foram fechadas.
+        """
+        pool_atual = self._pool
+        if pool_atual is None or pool_atual.closed:
+            return 0
+        agora = time.monotonic()
+        vencidas = []
+        with pool_atual._lock:
+            with self._info_lock:
+                for conn in list(pool_atual._pool):
+                    criada_em, ultimo_uso = self._info.setdefault(conn, [agora, agora])
+                    if (conn.closed or agora - ultimo_uso > self.max_idle
+                            or agora - criada_em > self.max_lifetime):
+                        pool_atual._pool.remove(conn)
+                        self._info.pop(conn, None)
+                        vencidas.append(conn)
+                self._expiradas += len(vencidas)
+        # Fecha fora dos locks: o close pode fazer I/O
+        for conn in vencidas:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        if vencidas:
+            self._logger.info(f"{len(vencidas)} conexão(ões) ociosa(s) ou expirada(s) fechada(s)")
+        return len(vencidas)
+    
+    def refill(self) -> int:
+        """Repõe conexões ociosas até ``minconn``, respeitando ``maxconn``.
+
+        As conexões são abertas fora do lock do pool, para que o handshake
+        com o banco não bloqueie os checkouts. Retorna quantas foram criadas.
+        """
+        criadas = 0
+        pool_atual = self._pool
+        while pool_atual is not None and pool_atual is self._pool and not pool_atual.closed:
+            with pool_atual._lock:
+                if len(pool_atual._pool) >= self.minconn:
+                    break
+                if len(pool_atual._pool) + len(pool_atual._used) >= self.maxconn:
+                    break
+            try:
+                conn = psycopg2.connect(*pool_atual._args, **pool_atual._kwargs)
+            except Exception as e:
+                self._logger.warning(f"Falha ao repor conexão do pool: {e}")
+                break
+            with pool_atual._lock:
+                cabe = (not pool_atual.closed and len(pool_atual._pool) < self.minconn
+                        and len(pool_atual._pool) + len(pool_atual._used) < self.maxconn)
+                if cabe:
+                    agora = time.monotonic()
+                    with self._info_lock:
+                        self._info[conn] = [agora, agora]
+                        self._repostas += 1
+                    pool_atual._pool.append(conn)
+                    criadas += 1
+            if not cabe:
+                conn.close()
+                break
+        return criadas
+    
+    def _iniciar_manutencao(self) -> None:
+        """Inicia a thread de limpeza/reposição do pool recém-criado"""
+        parar = Event()
+        self._parar_manutencao = parar
+        
+        def executar():
+            while not parar.wait(MAINTENANCE_INTERVAL):
                 try:
-                    # Força limpeza de conexões ociosas
-                    self._pool.closeall()
-                    self._pool = None
-                    self.create_pool()
+                    self.cleanup_idle_connections()
+                    self.refill()
                 except Exception as e:
-                    self._logger.error(f"Erro na limpeza de conexões: {e}")
+                    self._logger.error(f"Erro na manutenção do pool: {e}")
+        
+        Thread(target=executar, name="db-pool-manutencao", daemon=True).start()
+    
+    def _parar_manutencao_atual(self) -> None:
+        if self._parar_manutencao is not None:
+            self._parar_manutencao.set()
+            self._parar_manutencao = None
+    
+    def aguardando(self) -> int:
+        """Quantos checkouts estão na fila esperando uma conexão"""
+        return self._vagas.aguardando()
+    
+    def contagem(self) -> Tuple[int, int]:
+        """(em uso, ociosas), lidas sem lock: aproximadas, mas sem custo"""
+        pool_atual = self._pool
+        if pool_atual is None:
+            return 0, 0
+        return len(pool_atual._used), len(pool_atual._pool)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Configuração, ocupação e contadores do pool"""
+        pool_atual = self._pool
+        em_uso, ociosas = self.contagem()
+        with self._info_lock:
+            return {
+                "status": "ativo" if pool_atual is not None and not pool_atual.closed else "fechado",
+                "minconn": self.minconn,
+                "maxconn": self.maxconn,
+                "em_uso": em_uso,
+                "ociosas": ociosas,
+                "checkouts": self._checkouts,
+                "espera_media_ms": (self._espera_total / self._checkouts * 1000) if self._checkouts else 0.0,
+                "pings": self._pings,
+                "descartadas": self._descartadas,
+                "recriacoes": self._recriacoes,
+                "falhas": self._falhas,
+                "expiradas": self._expiradas,
+                "repostas": self._repostas,
+                "aguardando": self._vagas.aguardando(),
+                "esperas": self._esperas,
+                "espera_fila_media_ms": (self._espera_fila_total / self._esperas * 1000) if self._esperas else 0.0,
+                "espera_fila_max_ms": self._espera_fila_max * 1000,
+                "timeouts": self._timeouts,
+            }
 
 # Instância global do pool
 _pool = ConnectionPool()
 
 def get_conn():
-    """Obtém conexão do pool"""
-    return _pool.get_connection()
+    """Obtém conexão do pool (None se o banco estiver indisponível)"""
+    try:
+        return _pool.get_connection()
+    except Exception as e:
+        logger.error(f"Erro ao obter conexão do pool: {e}")
+        return None
 
 def put_conn(conn):
     """Retorna conexão ao pool"""
     _pool.put_connection(conn)
 
+def discard_conn(conn):
+    """Fecha uma conexão defeituosa em vez de devolvê-la ao pool"""
+    _pool.discard_connection(conn)
+
 def close_pool():
     """Fecha pool de conexões"""
     _pool.close_pool()
@@ -200,16 +608,7 @@ def get_pool_status() -> dict:
     Retorna status atual do pool.
     """
     try:
-        if not _pool._pool or _pool._pool.closed:
-            return {"status": "fechado", "conexoes_ativas": 0, "conexoes_total": 0}
-        
-        # Informações básicas do pool
-        return {
-            "status": "ativo",
-            "minconn": _pool._pool.minconn,
-            "maxconn": _pool._pool.maxconn,
-            "fechado": _pool._pool.closed
-        }
+        return _pool.stats()
     except Exception as e:
         return {"status": "erro", "erro": str(e)}
 
@@ -0,0 +1,100 @@
+"""
+Ponto de entrada de produção da API (gunicorn, pre-fork).
+
+O app é importado uma vez no master (preload), que também cria os objetos de
+banco (triggers de versões e eventos) uma única vez antes do fork. Cada worker
+só cria o próprio pool de conexões e thread de health check depois do fork,
+em vez de herdar sockets do master. Cada worker roda MAX_POOL_SIZE threads (uma conexão por
+thread no máximo) e o número de workers é limitado para que o total de
+conexões não passe de DB_MAX_CONEXOES.
+
+Sinais (gunicorn):
+    HUP   recarrega a configuração e troca os workers sem derrubar conexões
+    TERM  para de aceitar requisições e drena as em andamento por até
+          GRACEFUL_TIMEOUT segundos antes de fechar os pools
+
+As métricas de /api/metrics são agregadas entre os workers via
+PROMETHEUS_MULTIPROC_DIR (um diretório temporário por execução).
+
+Uso:
+    python serve.py
+"""
+import logging
+import multiprocessing
+import os
+import tempfile
+
+from gunicorn.app.base import BaseApplication
+
+# Com vários workers o bloqueio de login precisa ser compartilhado entre eles
+os.environ.setdefault('LOGIN_TENTATIVAS_BACKEND', 'sqlite')
+# Métricas de todos os workers agregadas em /api/metrics; precisa estar
+# definido antes de importar prometheus_client. Diretório novo a cada
+# execução para não somar arquivos de workers de uma execução anterior.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='teddy_metricas_'))
+# Poucas conexões ociosas por worker: o total é multiplicado pelos workers
+os.environ.setdefault('DB_POOL_MIN', '2')
+
+import app as api
+from db_connection import MAX_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+PORT = int(os.environ.get('PORT', 5000))
+DB_MAX_CONEXOES = int(os.environ.get('DB_MAX_CONEXOES', 100))  # Limite do lado do banco
+GRACEFUL_TIMEOUT = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+# Formato padrão do gunicorn com %(U)s (caminho sem query string) no lugar de
+# %(r)s: o stream SSE recebe o JWT em ?token= e não pode ir parar no log
+ACCESS_LOG_FORMAT = '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(f)s" "%(a)s"'
+TIMEOUT = int(os.environ.get('TIMEOUT', 60))
+
+def calcular_workers():
+    """Workers por CPU, sem ultrapassar DB_MAX_CONEXOES conexões no total"""
+    por_cpu = multiprocessing.cpu_count() * 2 + 1
+    por_banco = max(1, DB_MAX_CONEXOES // MAX_POOL_SIZE)
+    return int(os.environ.get('WEB_CONCURRENCY', min(por_cpu, por_banco)))
+
+def post_fork(server, worker):
+    if not api.iniciar_worker():
+        logger.error(f"Worker {worker.pid}: falha ao criar pool; será recriado na primeira requisição")
+
+def worker_exit(server, worker):
+    # Chamado após drenar as requisições em andamento
+    api.cleanup_pool()
+    if api.prometheus_client is not None:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+class ServidorAPI(BaseApplication):
+    """Aplicação gunicorn configurada em código (sem arquivo de config)"""
+
+    def __init__(self, aplicacao, opcoes):
+        self.aplicacao = aplicacao
+        self.opcoes = opcoes
+        super().__init__()
+
+    def load_config(self):
+        for chave, valor in self.opcoes.items():
+            self.cfg.set(chave, valor)
+
+    def load(self):
+        return self.aplicacao
+
+if __name__ == '__main__':
+    opcoes = {
+        'bind': f'0.0.0.0:{PORT}',
+        'workers': calcular_workers(),
+        'worker_class': 'gthread',
+        'threads': MAX_POOL_SIZE,
+        'preload_app': True,
+        'timeout': TIMEOUT,
+        'graceful_timeout': GRACEFUL_TIMEOUT,
+        'keepalive': 5,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+        'accesslog': '-',
+        'access_log_format': ACCESS_LOG_FORMAT,
+    }
+    if not api.inicializar_banco():
+        logger.warning("Objetos de banco não inicializados; versões e eventos podem ficar indisponíveis")
+    ServidorAPI(api.app, opcoes).run()
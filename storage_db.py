@@ -1,13 +1,24 @@
 import datetime
 import re
+import sys
+import time
+import logging
+import threading
 import unicodedata
 import hashlib
 import psycopg2
+from psycopg2.extensions import (
+    TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS, TRANSACTION_STATUS_UNKNOWN,
+)
+from collections import deque
 from functools import lru_cache
 from contextlib import contextmanager
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Any
+from main.backend.busca_os import BUSCA_OS_SQL, OS_NUMERO_EXPR
 from main.backend.db_connection import get_conn, put_conn
 
+logger = logging.getLogger(__name__)
+
 # --- Cache para normalização de nomes ---
 @lru_cache(maxsize=128)
 def _normalize(col_name: str) -> str:
@@ -25,9 +36,235 @@ def _normalize(col_name: str) -> str:
         return f'data_pag{m.group(1)}'
     return s
 
+# --- Instrumentação de queries ---
+SLOW_QUERY_MS = 500  # Queries mais lentas que isso vão para o log de queries lentas
+SLOW_QUERY_LOG_MAX = 200  # Últimas queries lentas mantidas em memória
+_AMOSTRA_BYTES = 100  # Linhas medidas para estimar os bytes lidos de um fetch
+
+_query_stats: Dict[tuple, Dict[str, Any]] = {}  # (sitio, sql) -> contadores
+_query_stats_lock = threading.Lock()
+_slow_queries: deque = deque(maxlen=SLOW_QUERY_LOG_MAX)
+_contadores_locais = threading.local()  # Contadores de contar_round_trips() da thread
+
+class ContadorRoundTrips:
+    """Idas ao banco feitas dentro de um bloco contar_round_trips()."""
+
+    def __init__(self):
+        self.total = 0
+        self.por_sql: Dict[str, int] = {}
+
+    def __repr__(self):
+        return f"ContadorRoundTrips(total={self.total}, por_sql={self.por_sql})"
+
+@contextmanager
+def contar_round_trips():
+    """
+    Conta as idas ao banco (BEGIN, queries, fetches de cursor nomeado,
+    COMMIT/ROLLBACK) feitas pela thread atual dentro do bloco:
+
+        with contar_round_trips() as rt:
+            load_tecnicos()
+        assert rt.total == 1
+    """
+    contador = ContadorRoundTrips()
+    pilha = getattr(_contadores_locais, 'pilha', None)
+    if pilha is None:
+        pilha = _contadores_locais.pilha = []
+    pilha.append(contador)
+    try:
+        yield contador
+    finally:
+        pilha.remove(contador)
+
+def _estimar_bytes(rows: List[tuple]) -> int:
+    """Estima os bytes lidos medindo até _AMOSTRA_BYTES linhas e extrapolando."""
+    if not rows:
+        return 0
+    amostra = rows[:_AMOSTRA_BYTES]
+    total = 0
+    for row in amostra:
+        for valor in row:
+            if valor is None:
+                continue
+            if isinstance(valor, (str, bytes, bytearray, memoryview)):
+                total += len(valor)
+            else:
+                total += 8
+    return total * len(rows) // len(amostra)
+
+def _registrar_query(sitio: str, sql: Any, segundos: float, linhas: int,
+                     nbytes: int, round_trips: int) -> None:
+    """Acumula as medidas de uma query e registra no log se for lenta."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')  # execute_values monta a query em bytes
+    sql = ' '.join(str(sql).split())[:200]
+    with _query_stats_lock:
+        stats = _query_stats.get((sitio, sql))
+        if stats is None:
+            stats = _query_stats[(sitio, sql)] = {
+                'chamadas': 0, 'segundos': 0.0, 'max_segundos': 0.0,
+                'linhas': 0, 'bytes': 0, 'round_trips': 0,
+            }
+        stats['chamadas'] += 1
+        stats['segundos'] += segundos
+        stats['max_segundos'] = max(stats['max_segundos'], segundos)
+        stats['linhas'] += linhas
+        stats['bytes'] += nbytes
+        stats['round_trips'] += round_trips
+    for contador in getattr(_contadores_locais, 'pilha', ()):
+        contador.total += round_trips
+        contador.por_sql[sql] = contador.por_sql.get(sql, 0) + round_trips
+    if segundos * 1000 >= SLOW_QUERY_MS:
+        _slow_queries.append({
+            'quando': datetime.datetime.now().isoformat(timespec='seconds'),
+            'sitio': sitio, 'sql': sql, 'ms': segundos * 1000,
+            'linhas': linhas, 'round_trips': round_trips,
+        })
+        logger.warning(
+            f"Query lenta ({segundos * 1000:.0f} ms) em {sitio}: {sql} "
+            f"[{linhas} linhas, {round_trips} round trips]"
+        )
+
+class _InstrumentacaoCursor:
+    """Mede tempo, linhas, bytes e round trips de cada query de um cursor.
+
+    As medidas de uma query (execute + fetches) são consolidadas quando a
+    próxima query começa ou o cursor é fechado, sob a chave (sitio, sql).
+    Mixin sobre uma classe de cursor do psycopg2 (ou um cursor falso nos
+    testes, que exercitam esta mesma contagem).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sitio = '?'
+        self._atual = None  # [sql, segundos, linhas, bytes, round_trips]
+
+    def _concluir(self) -> None:
+        if self._atual is not None:
+            _registrar_query(self.sitio, *self._atual)
+            self._atual = None
+
+    def _round_trips_iniciais(self) -> int:
+        """1 pela query, +1 pelo BEGIN que o psycopg2 envia antes se não houver transação"""
+        conn = self.connection
+        if not conn.autocommit and conn.info.transaction_status == TRANSACTION_STATUS_IDLE:
+            return 2
+        return 1
+
+    def execute(self, query, vars=None):
+        self._concluir()
+        self._atual = [query, 0.0, 0, 0, self._round_trips_iniciais()]
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._atual[1] += time.perf_counter() - inicio
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        self._concluir()
+        # executemany faz uma ida ao banco por conjunto de parâmetros
+        self._atual = [query, 0.0, 0, 0, len(vars_list) + self._round_trips_iniciais() - 1]
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._atual[1] += time.perf_counter() - inicio
+
+    def _contar(self, rows: List[tuple], inicio: float) -> None:
+        if self._atual is None:
+            return
+        self._atual[1] += time.perf_counter() - inicio
+        self._atual[2] += len(rows)
+        self._atual[3] += _estimar_bytes(rows)
+        if self.name is not None:
+            self._atual[4] += 1  # Cursor nomeado: cada fetch vai ao servidor
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        row = super().fetchone()
+        self._contar([row] if row is not None else [], inicio)
+        return row
+
+    def fetchmany(self, size=None):
+        inicio = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._contar(rows, inicio)
+        return rows
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        rows = super().fetchall()
+        self._contar(rows, inicio)
+        return rows
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        if (self.name is not None and not self.closed and self._atual is not None
+                and self.connection.info.transaction_status == TRANSACTION_STATUS_INTRANS):
+            self._atual[4] += 1  # Cursor nomeado aberto: o psycopg2 envia CLOSE
+        self._concluir()
+        super().close()
+
+class _CursorInstrumentado(_InstrumentacaoCursor, psycopg2.extensions.cursor):
+    """Cursor do psycopg2 com as medidas de _InstrumentacaoCursor."""
+
+def get_query_stats(limit: int = 20, ordem: str = 'segundos') -> List[Dict[str, Any]]:
+    """
+    Call sites mais pesados, ordenados por ``ordem`` (segundos, chamadas,
+    linhas, bytes, round_trips ou max_segundos). Tempos em milissegundos.
+    """
+    with _query_stats_lock:
+        itens = [(chave, dict(stats)) for chave, stats in _query_stats.items()]
+    itens.sort(key=lambda item: item[1][ordem], reverse=True)
+    return [
+        {
+            'sitio': sitio,
+            'sql': sql,
+            'chamadas': stats['chamadas'],
+            'total_ms': stats['segundos'] * 1000,
+            'media_ms': stats['segundos'] * 1000 / stats['chamadas'],
+            'max_ms': stats['max_segundos'] * 1000,
+            'linhas': stats['linhas'],
+            'bytes': stats['bytes'],
+            'round_trips': stats['round_trips'],
+        }
+        for (sitio, sql), stats in itens[:limit]
+    ]
+
+def get_slow_queries() -> List[Dict[str, Any]]:
+    """Últimas queries acima de SLOW_QUERY_MS (mais antigas primeiro)."""
+    return list(_slow_queries)
+
+def reset_query_stats() -> None:
+    """Zera as estatísticas e o log de queries lentas."""
+    with _query_stats_lock:
+        _query_stats.clear()
+    _slow_queries.clear()
+
 @contextmanager
-def get_db_cursor():
-    """Context manager para gerenciar conexões de forma segura."""
+def get_db_cursor(sitio: Optional[str] = None, somente_leitura: bool = False,
+                  nome: Optional[str] = None):
+    """
+    Context manager para gerenciar conexões de forma segura.
+    As queries são contabilizadas por ``sitio`` (padrão: a função que abriu
+    o cursor); veja get_query_stats(). Com ``nome`` o cursor é nomeado
+    (server-side) e as linhas são buscadas aos poucos a cada fetch.
+
+    Com ``somente_leitura`` o bloco roda em autocommit: sem o BEGIN e o
+    COMMIT que o psycopg2 enviaria, uma leitura de uma query custa uma
+    única ida ao banco. Não use com cursores nomeados nem com várias
+    escritas que precisam ser atômicas.
+    """
+    if sitio is None:
+        # 0 = este gerador, 1 = __enter__ do contextmanager, 2 = quem chamou
+        sitio = sys._getframe(2).f_code.co_name
     conn = get_conn()
     try:
         # Garante que a conexão está aberta
@@ -35,33 +272,110 @@ def get_db_cursor():
             conn = get_conn()
         if conn is None or (hasattr(conn, 'closed') and conn.closed):
             raise Exception("Não foi possível obter uma conexão válida com o banco de dados.")
-        # Limpa transação abortada se houver
-        conn.rollback()
-        cur = conn.cursor()
+        # Limpa transação deixada aberta/abortada, se houver. O status é lido
+        # localmente (sem round trip) e o pool já faz rollback na devolução,
+        # então o ROLLBACK só vai ao banco se alguém usou a conexão sem fechar.
+        _encerrar_transacao(conn, sitio, commit=False)
+        if somente_leitura:
+            conn.autocommit = True
+        cur = conn.cursor(name=nome, cursor_factory=_CursorInstrumentado)
+        cur.sitio = sitio
         try:
             yield cur
-            conn.commit()
+            # Antes do COMMIT: depois dele o psycopg2 recusa fechar um cursor
+            # nomeado ("named cursor isn't valid anymore")
+            cur.close()
+            _encerrar_transacao(conn, sitio, commit=True)
         except Exception:
-            conn.rollback()
+            _fechar_cursor(cur)
+            _encerrar_transacao(conn, sitio, commit=False)
             raise
         finally:
-            cur.close()
+            _fechar_cursor(cur)  # GeneratorExit de um iter_table interrompido
     finally:
         if conn is not None:
+            if somente_leitura and not conn.closed:
+                conn.autocommit = False
             put_conn(conn)
 
+def _fechar_cursor(cur) -> None:
+    """Fecha o cursor se ainda aberto, sem mascarar o erro em andamento."""
+    if not cur.closed:
+        try:
+            cur.close()
+        except Exception:
+            pass
+
+def _encerrar_transacao(conn, sitio: str, commit: bool) -> None:
+    """COMMIT/ROLLBACK só quando há transação aberta (checado localmente)."""
+    status = TRANSACTION_STATUS_UNKNOWN if conn.closed else conn.info.transaction_status
+    if status in (TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN):
+        return  # Nada a encerrar, ou conexão perdida (o pool a descarta)
+    inicio = time.perf_counter()
+    try:
+        if commit:
+            conn.commit()
+        else:
+            conn.rollback()
+    finally:
+        _registrar_query(sitio, 'COMMIT' if commit else 'ROLLBACK',
+                         time.perf_counter() - inicio, 0, 0, 1)
+
 def get_table(table_name: str) -> List[Dict[str, Any]]:
     """Busca toda uma tabela sem normalizar nomes."""
-    with get_db_cursor() as cur:
+    with get_db_cursor(somente_leitura=True) as cur:
         cur.execute(f"SELECT * FROM {table_name}")
         cols = [d[0] for d in cur.description]
         rows = cur.fetchall()
     return [dict(zip(cols, row)) for row in rows]
 
+ITER_TABLE_BATCH = 2000  # Linhas por ida ao cursor server-side em iter_table()
+
+def _formatar_valor(value: Any) -> Any:
+    """Formata datas como dd/mm/aaaa; demais valores passam inalterados."""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime("%d/%m/%Y")
+    return value
+
+def iter_table(table_name: str, batch_size: int = ITER_TABLE_BATCH,
+               colunas: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Percorre uma tabela sob demanda com um cursor nomeado (server-side).
+
+    Produz um registro normalizado por vez (mesmo formato de
+    get_table_normalized) ou, com ``colunas=True``, um dict
+    ``{coluna: [valores]}`` por lote de até ``batch_size`` linhas. Só um lote
+    fica em memória; a conexão fica ocupada até o gerador terminar ou ser
+    fechado (break/close()).
+    """
+    with get_db_cursor(nome='iter_table') as cur:
+        cur.itersize = batch_size
+        cur.execute(f"SELECT * FROM {table_name}")
+        nomes = None
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if nomes is None:
+                # Em cursor nomeado a descrição só existe após o primeiro fetch
+                nomes = [_normalize(d[0]) for d in cur.description]
+            if not rows:
+                break
+            if colunas:
+                yield {
+                    nome: [_formatar_valor(row[i]) for row in rows]
+                    for i, nome in enumerate(nomes)
+                }
+            else:
+                for row in rows:
+                    yield {nome: _formatar_valor(valor) for nome, valor in zip(nomes, row)}
+            if len(rows) < batch_size:
+                break  # Último lote: evita um FETCH vazio
+
 def get_table_normalized(table_name: str) -> List[Dict[str, Any]]:
     """Busca com normalização de colunas e formatação de datas otimizada."""
-    raw = get_table(table_name)
-    
+    return _normalize_records(get_table(table_name))
+
+def _normalize_records(raw: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Normaliza nomes de coluna e formata datas de uma lista de registros."""
     # Pré-computa as normalizações das colunas uma vez
     if not raw:
         return []
@@ -73,19 +387,14 @@ def get_table_normalized(table_name: str) -> List[Dict[str, Any]]:
     for rec in raw:
         new = {}
         for original_col, value in rec.items():
-            normalized_col = normalized_cols[original_col]
-            # Formatação de datas otimizada
-            if isinstance(value, (datetime.date, datetime.datetime)):
-                new[normalized_col] = value.strftime("%d/%m/%Y")
-            else:
-                new[normalized_col] = value
+            new[normalized_cols[original_col]] = _formatar_valor(value)
         data.append(new)
     return data
 
 # --- Carregamentos otimizados ---
 def load_usuarios() -> Dict[str, Dict[str, str]]:
     """Carrega usuários com estrutura otimizada."""
-    with get_db_cursor() as cur:
+    with get_db_cursor(somente_leitura=True) as cur:
         cur.execute("SELECT usuario, senha, nome, cargo FROM usuarios")
         return {
             row[0]: {'senha': row[1], 'nome': row[2], 'cargo': row[3]}
@@ -110,7 +419,7 @@ def get_os_cadastros() -> List[Dict[str, Any]]:
 
 def load_tecnicos() -> List[str]:
     """Carrega todos os nomes de técnicos cadastrados."""
-    with get_db_cursor() as cur:
+    with get_db_cursor(somente_leitura=True) as cur:
         cur.execute("SELECT nome FROM tecnicos ORDER BY nome")
         return [row[0] for row in cur.fetchall()]
 
@@ -121,7 +430,7 @@ def insert_tecnico(nome: str) -> None:
 
 def load_gerentes() -> List[str]:
     """Carrega todos os nomes de gerentes cadastrados."""
-    with get_db_cursor() as cur:
+    with get_db_cursor(somente_leitura=True) as cur:
         cur.execute("SELECT nome FROM gerentes ORDER BY nome")
         return [row[0] for row in cur.fetchall()]
 
@@ -212,6 +521,37 @@ def delete_os(os_number: str) -> None:
     with get_db_cursor() as cur:
         cur.execute('DELETE FROM os_cadastros WHERE "OS" = %s', (os_number,))
 
+def os_existe(numero: str) -> bool:
+    """Verifica se já existe OS com o número (sem diferenciar maiúsculas/espaços).
+
+    A expressão é a do índice idx_os_cadastros_os_numero (busca_os.py).
+    """
+    with get_db_cursor(somente_leitura=True) as cur:
+        cur.execute(
+            f'SELECT 1 FROM os_cadastros WHERE {OS_NUMERO_EXPR} = %s LIMIT 1',
+            ((numero or '').strip().lower(),)
+        )
+        return cur.fetchone() is not None
+
+# --- Busca textual em OS (SQL e índices em busca_os.py) ---
+def search_os(q: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    Busca OS por cliente, modelo, número, série ou técnico.
+    Retorna registros normalizados (como get_os_cadastros) ordenados por relevância.
+    """
+    q = (q or '').strip().lower()
+    if not q:
+        return []
+    padrao = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    with get_db_cursor(somente_leitura=True) as cur:
+        cur.execute(BUSCA_OS_SQL, {'q': q, 'padrao': padrao, 'limit': limit, 'offset': offset})
+        cols = [d[0] for d in cur.description]
+        rows = cur.fetchall()
+    raw = [dict(zip(cols, row)) for row in rows]
+    for rec in raw:
+        rec.pop('_rank', None)
+    return _normalize_records(raw)
+
 # --- Cache para hashes de senha ---
 @lru_cache(maxsize=256)
 def _hash_password(password: str) -> str:
@@ -222,7 +562,7 @@ def authenticate_user(usuario: str, senha: str) -> Optional[Dict[str, str]]:
     """Autenticação otimizada com menos queries e cache."""
     
     try:
-        with get_db_cursor() as cur:
+        with get_db_cursor(somente_leitura=True) as cur:
             cur.execute(
                 "SELECT senha, nome, cargo FROM usuarios WHERE usuario = %s",
                 (usuario,)
@@ -230,7 +570,7 @@ def authenticate_user(usuario: str, senha: str) -> Optional[Dict[str, str]]:
             row = cur.fetchone()
     except psycopg2.OperationalError:
         # Retry em caso de erro de conexão
-        with get_db_cursor() as cur:
+        with get_db_cursor(somente_leitura=True) as cur:
             cur.execute(
                 "SELECT senha, nome, cargo FROM usuarios WHERE usuario = %s",
                 (usuario,)
@@ -293,7 +633,7 @@ def insert_usuarios_bulk(usuarios_data: List[tuple]) -> None:
 
 def get_usuarios_by_cargo(cargo: str) -> List[Dict[str, Any]]:
     """Busca usuários por cargo com query específica."""
-    with get_db_cursor() as cur:
+    with get_db_cursor(somente_leitura=True) as cur:
         cur.execute(
             "SELECT usuario, nome, cargo FROM usuarios WHERE cargo = %s",
             (cargo,)
@@ -442,7 +782,7 @@ def get_cliente_by_id(cliente_id: int) -> Optional[Dict[str, Any]]:
     """
     Busca um cliente específico pelo ID.
     """
-    with get_db_cursor() as cur:
+    with get_db_cursor(somente_leitura=True) as cur:
         cur.execute("SELECT * FROM clientes WHERE id = %s", (cliente_id,))
         row = cur.fetchone()
         if row:
@@ -454,7 +794,7 @@ def get_cliente_by_nome(nome: str) -> List[Dict[str, Any]]:
     """
     Busca clientes pelo nome (busca parcial).
     """
-    with get_db_cursor() as cur:
+    with get_db_cursor(somente_leitura=True) as cur:
         cur.execute(
             "SELECT * FROM clientes WHERE nome ILIKE %s ORDER BY nome",
             (f"%{nome}%",)
@@ -467,7 +807,7 @@ def get_cliente_by_cpf_cnpj(cpf_cnpj: str) -> Optional[Dict[str, Any]]:
     """
     Busca um cliente pelo CPF/CNPJ.
     """
-    with get_db_cursor() as cur:
+    with get_db_cursor(somente_leitura=True) as cur:
         cur.execute("SELECT * FROM clientes WHERE cpf_cnpj = %s", (cpf_cnpj,))
         row = cur.fetchone()
         if row:
@@ -479,7 +819,7 @@ def check_cliente_exists(nome: str, cpf_cnpj: str = None) -> bool:
     """
     Verifica se um cliente já existe no banco.
     """
-    with get_db_cursor() as cur:
+    with get_db_cursor(somente_leitura=True) as cur:
         if cpf_cnpj:
             cur.execute(
                 "SELECT COUNT(*) FROM clientes WHERE nome = %s OR cpf_cnpj = %s",
@@ -559,7 +899,7 @@ def table_exists(table_name: str) -> bool:
     """
     Verifica se uma tabela existe no banco de dados.
     """
-    with get_db_cursor() as cur:
+    with get_db_cursor(somente_leitura=True) as cur:
         cur.execute(
             """SELECT EXISTS (
                 SELECT FROM information_schema.tables 
@@ -620,20 +960,10 @@ def delete_gerente(nome: str) -> None:
 
 def check_serial_autorizado(serial: str) -> bool:
     """Verifica se o serial da placa-mãe está autorizado na tabela 'autorizados'."""
-    from main.backend.db_connection import get_conn, put_conn
-    conn = None
     try:
-        conn = get_conn()
-        if not conn:
-            return False
-        cur = conn.cursor()
-        cur.execute('SELECT 1 FROM autorizados WHERE serial_placa_mae = %s', (serial,))
-        autorizado = cur.fetchone() is not None
-        cur.close()
-        return autorizado
+        with get_db_cursor(somente_leitura=True) as cur:
+            cur.execute('SELECT 1 FROM autorizados WHERE serial_placa_mae = %s', (serial,))
+            return cur.fetchone() is not None
     except Exception as e:
         print(f'Erro ao verificar autorização do serial: {e}')
-        return False
-    finally:
-        if conn:
-            put_conn(conn)
\ No newline at end of file
+        return False
\ No newline at end of file
@@ -0,0 +1,18 @@
+"""
+Monta o pacote ``main.backend`` apontando para a raiz do repositório.
+
+O código desktop importa ``main.backend.<módulo>`` (storage_db importa
+``main.backend.db_connection``), mas no repositório os arquivos ficam na raiz.
+"""
+import os
+import sys
+import types
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for nome, caminho in (('main', []), ('main.backend', [RAIZ])):
+    if nome not in sys.modules:
+        modulo = types.ModuleType(nome)
+        modulo.__path__ = caminho
+        sys.modules[nome] = modulo
+sys.modules['main'].backend = sys.modules['main.backend']
@@ -0,0 +1,91 @@
+"""
+Fila de vagas do ConnectionPool sobre um ThreadedConnectionPool falso.
+
+As conexões são objetos falsos, mas o pool do psycopg2 é o real: o
+``_used`` dele só esvazia quando o putconn termina, então uma vaga liberada
+antes disso faria o próximo da fila levar "connection pool exhausted" (e o
+backoff de RETRY_DELAY). O putconn falso demora a pegar o lock do pool, como
+uma thread preemptada entre liberar a vaga e devolver a conexão.
+"""
+import logging
+import threading
+import time
+import types
+
+import pytest
+from psycopg2 import pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from main.backend import db_connection
+
+ATRASO_PUTCONN = 0.05
+
+
+class ConexaoFalsa:
+    """Volta ao pool com transação aberta: o putconn faz rollback"""
+
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = False
+        self.info = types.SimpleNamespace(transaction_status=TRANSACTION_STATUS_IDLE)
+
+    def rollback(self):
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class PoolFalso(pool.ThreadedConnectionPool):
+    def _connect(self, key=None):
+        conn = ConexaoFalsa()
+        if key is not None:
+            self._used[key] = conn
+            self._rused[id(conn)] = key
+        else:
+            self._pool.append(conn)
+        return conn
+
+    def putconn(self, conn=None, key=None, close=False):
+        time.sleep(ATRASO_PUTCONN)
+        super().putconn(conn, key, close)
+
+
+@pytest.fixture
+def pool_falso(monkeypatch):
+    monkeypatch.setattr(db_connection.pool, 'ThreadedConnectionPool', PoolFalso)
+    monkeypatch.setattr(db_connection.ConnectionPool, '_iniciar_manutencao', lambda self: None)
+    cp = db_connection.ConnectionPool(minconn=1, maxconn=2, timeout=10, idle_ping=3600)
+    yield cp
+    cp.close_pool()
+
+
+@pytest.mark.parametrize('devolver', ['put_connection', 'discard_connection'])
+def test_mais_threads_que_maxconn_sem_esgotar_o_pool(pool_falso, caplog, devolver):
+    erros = []
+    esperas = []
+
+    def trabalhar():
+        try:
+            for _ in range(3):
+                inicio = time.monotonic()
+                conn = pool_falso.get_connection()
+                esperas.append(time.monotonic() - inicio)
+                conn.info.transaction_status = TRANSACTION_STATUS_INTRANS
+                getattr(pool_falso, devolver)(conn)
+        except Exception as e:
+            erros.append(e)
+
+    with caplog.at_level(logging.ERROR, logger=db_connection.__name__):
+        threads = [threading.Thread(target=trabalhar) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    assert erros == []
+    assert not [r for r in caplog.records if 'Erro ao obter conexão' in r.getMessage()]
+    # Sem retry: ninguém passa pelo backoff de RETRY_DELAY
+    assert max(esperas) < db_connection.RETRY_DELAY
+    assert pool_falso._vagas.acquire(0) and pool_falso._vagas.acquire(0)
+    assert not pool_falso._vagas.acquire(0)
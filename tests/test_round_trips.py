@@ -0,0 +1,300 @@
+"""
+Orçamento de idas ao banco (round trips) de cada função pública de storage_db.
+
+A conexão e o cursor são falsos e registram, eles mesmos, cada comando que
+o psycopg2 mandaria ao servidor: BEGIN implícito no primeiro comando fora de
+autocommit, o comando em si (um por conjunto de parâmetros no executemany),
+um FETCH por fetch em cursor nomeado, o CLOSE do cursor nomeado e
+COMMIT/ROLLBACK só com transação aberta. A contagem não depende de
+storage_db._InstrumentacaoCursor; test_instrumentacao_confere_com_as_idas
+compara as duas.
+"""
+import types
+
+import psycopg2
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from main.backend import storage_db
+
+
+class CursorFalso:
+    """Cursor mínimo do psycopg2: executa contra as respostas da conexão"""
+
+    def __init__(self, conn, name=None):
+        self.connection = conn
+        self.name = name
+        self.description = None
+        self.rowcount = -1
+        self.arraysize = 1
+        self.itersize = 2000
+        self.closed = False
+        self._linhas = []
+        self._executado = False
+        self._marca = conn.marca  # Como o mark do psycopg2: muda a cada COMMIT/ROLLBACK
+
+    def execute(self, query, vars=None):
+        self._executar(query)
+
+    def executemany(self, query, vars_list):
+        # Como no psycopg2, não passa pelo execute() da subclasse
+        for _ in vars_list:
+            self._executar(query)
+
+    def _executar(self, query):
+        self.connection.enviar(query)
+        self._executado = True
+        colunas, linhas = self.connection.responder(query)
+        self.description = [(c, None, None, None, None, None, None) for c in colunas]
+        self._linhas = list(linhas)
+        self.rowcount = len(self._linhas)
+
+    def _buscar(self):
+        if self.name is not None:
+            self.connection.enviar('FETCH')
+
+    def fetchone(self):
+        self._buscar()
+        return self._linhas.pop(0) if self._linhas else None
+
+    def fetchmany(self, size=None):
+        self._buscar()
+        linhas, self._linhas = self._linhas[:size], self._linhas[size:]
+        return linhas
+
+    def fetchall(self):
+        self._buscar()
+        linhas, self._linhas = self._linhas, []
+        return linhas
+
+    def close(self):
+        if self.closed:
+            return
+        if self.name is not None and self._executado:
+            if self._marca != self.connection.marca:
+                raise psycopg2.ProgrammingError("named cursor isn't valid anymore")
+            self.connection.enviar('CLOSE')
+        self.closed = True
+
+
+class CursorInstrumentadoFalso(storage_db._InstrumentacaoCursor, CursorFalso):
+    pass
+
+
+class ConexaoFalsa:
+    """Conexão que guarda o status da transação como a libpq e anota as idas"""
+
+    def __init__(self):
+        self.autocommit = False
+        self.closed = 0
+        self.info = types.SimpleNamespace(transaction_status=TRANSACTION_STATUS_IDLE)
+        self.respostas = {}  # trecho do SQL -> (colunas, linhas)
+        self.idas = []  # Tudo o que foi ao servidor, na ordem
+        self.marca = 0
+        self.classe_cursor = CursorFalso
+
+    def enviar(self, comando):
+        if not self.autocommit and self.info.transaction_status == TRANSACTION_STATUS_IDLE:
+            self.idas.append('BEGIN')
+            self.info.transaction_status = TRANSACTION_STATUS_INTRANS
+        self.idas.append(comando)
+
+    def responder(self, query):
+        for trecho, resposta in self.respostas.items():
+            if trecho in query:
+                return resposta
+        return [], []
+
+    def cursor(self, name=None, cursor_factory=None):
+        assert cursor_factory is storage_db._CursorInstrumentado
+        return self.classe_cursor(self, name)
+
+    def _encerrar(self, comando):
+        # Sem transação aberta o psycopg2 não manda nada
+        if self.info.transaction_status == TRANSACTION_STATUS_INTRANS:
+            self.idas.append(comando)
+            self.marca += 1
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self._encerrar('COMMIT')
+
+    def rollback(self):
+        self._encerrar('ROLLBACK')
+
+
+@pytest.fixture
+def conexao(monkeypatch):
+    conn = ConexaoFalsa()
+    monkeypatch.setattr(storage_db, 'get_conn', lambda: conn)
+    monkeypatch.setattr(storage_db, 'put_conn', lambda c: None)
+    return conn
+
+
+def idas(conexao, funcao, *args):
+    """Executa a função (consumindo geradores) e retorna o que foi ao servidor"""
+    conexao.idas = []
+    resultado = funcao(*args)
+    if isinstance(resultado, types.GeneratorType):
+        list(resultado)
+    return conexao.idas
+
+
+# Leituras em autocommit: só a query, sem BEGIN/COMMIT
+LEITURAS = [
+    (storage_db.get_table, ('os_cadastros',)),
+    (storage_db.get_table_normalized, ('os_cadastros',)),
+    (storage_db.load_usuarios, ()),
+    (storage_db.load_clientes, ()),
+    (storage_db.get_os_cadastros, ()),
+    (storage_db.load_solicitacoes, ()),
+    (storage_db.load_equipamentos, ()),
+    (storage_db.load_tecnicos, ()),
+    (storage_db.load_gerentes, ()),
+    (storage_db.os_existe, ('123',)),
+    (storage_db.search_os, ('teclado',)),
+    (storage_db.authenticate_user, ('admin', '123')),
+    (storage_db.get_usuarios_by_cargo, ('tecnico',)),
+    (storage_db.get_cliente_by_id, (1,)),
+    (storage_db.get_cliente_by_nome, ('Ana',)),
+    (storage_db.get_cliente_by_cpf_cnpj, ('000',)),
+    (storage_db.check_cliente_exists, ('Ana',)),
+    (storage_db.check_cliente_exists, ('Ana', '000')),
+    (storage_db.table_exists, ('clientes',)),
+    (storage_db.check_serial_autorizado, ('ABC',)),
+]
+
+# Escritas de um comando: BEGIN + comando + COMMIT
+ESCRITAS = [
+    (storage_db.insert_tecnico, ('Ana',)),
+    (storage_db.insert_gerente, ('Ana',)),
+    (storage_db.insert_solicitacao, ('ana', 'hash', 'Ana')),
+    (storage_db.insert_os, (7, '7', 'Ana', 'X', '', '', '', '', '', '', '', '', '', '', 'Aberta')),
+    (storage_db.delete_os, ('7',)),
+    (storage_db.insert_usuario, ('ana', 'hash', 'Ana', 'tecnico')),
+    (storage_db.update_usuario, ('ana', 'nome', 'Ana Maria')),
+    (storage_db.delete_solicitacao, ('ana',)),
+    (storage_db.insert_cliente, ({'nome': 'Ana'},)),
+    (storage_db.update_cliente, (1, {'nome': 'Ana'})),
+    (storage_db.delete_cliente, (1,)),
+    (storage_db.update_status_os, (1, 'Pronta')),
+    (storage_db.delete_tecnico, ('Ana',)),
+    (storage_db.delete_gerente, ('Ana',)),
+]
+
+RESPOSTAS = {
+    'COUNT(*)': (['count'], [(0,)]),
+    'EXISTS': (['exists'], [(True,)]),
+    'RETURNING id': (['id'], [(1,)]),
+}
+
+
+def _nome(caso):
+    funcao, args = caso
+    return f"{funcao.__name__}{args!r}"
+
+
+@pytest.mark.parametrize('funcao,args', LEITURAS, ids=[_nome(c) for c in LEITURAS])
+def test_leitura_custa_uma_ida(conexao, funcao, args):
+    conexao.respostas = RESPOSTAS
+    enviados = idas(conexao, funcao, *args)
+    assert len(enviados) == 1
+    assert enviados[0] not in ('BEGIN', 'FETCH', 'CLOSE', 'COMMIT', 'ROLLBACK')
+    assert conexao.info.transaction_status == TRANSACTION_STATUS_IDLE
+    assert conexao.autocommit is False
+
+
+@pytest.mark.parametrize('funcao,args', ESCRITAS, ids=[_nome(c) for c in ESCRITAS])
+def test_escrita_simples_custa_tres_idas(conexao, funcao, args):
+    conexao.respostas = RESPOSTAS
+    enviados = idas(conexao, funcao, *args)
+    assert len(enviados) == 3
+    assert (enviados[0], enviados[-1]) == ('BEGIN', 'COMMIT')
+    assert conexao.info.transaction_status == TRANSACTION_STATUS_IDLE
+
+
+def test_insert_os_sem_id_busca_o_proximo_na_mesma_transacao(conexao):
+    conexao.respostas = {'MAX(id)': (['proximo'], [(8,)])}
+    args = (None, '8', 'Ana', 'X', '', '', '', '', '', '', '', '', '', '', 'Aberta')
+    enviados = idas(conexao, storage_db.insert_os, *args)
+    assert len(enviados) == 4
+    assert (enviados[0], enviados[-1]) == ('BEGIN', 'COMMIT')
+
+
+def test_insert_usuarios_bulk(conexao):
+    usuarios = [('a', 'h', 'A', 'tecnico'), ('b', 'h', 'B', 'tecnico'), ('c', 'h', 'C', 'gerente')]
+    # BEGIN + um INSERT por usuário + COMMIT
+    assert len(idas(conexao, storage_db.insert_usuarios_bulk, usuarios)) == 2 + len(usuarios)
+
+
+def test_save_equipamentos_so_envia_o_que_mudou(conexao):
+    conexao.respostas = {
+        'SELECT equipamento': (['equipamento', 'tipo', 'marca'],
+                               [('A', 'Tipo', 'Marca'), ('B', 'Tipo', 'Marca')]),
+    }
+    # Nada mudou: BEGIN + SELECT + COMMIT
+    assert len(idas(conexao, storage_db.save_equipamentos,
+                    {'A': ['Tipo', 'Marca'], 'B': ['Tipo', 'Marca']})) == 3
+    # Remove B, insere C, atualiza A: uma ida a mais por alteração
+    novos = {'A': ['Outro', 'Marca'], 'C': ['Tipo', 'Marca']}
+    assert len(idas(conexao, storage_db.save_equipamentos, novos)) == 3 + 3
+
+
+def test_save_clientes(conexao):
+    clientes = [{'nome': 'Ana'}, {'nome': 'Bia'}]
+    # BEGIN + DELETE + um INSERT por cliente + COMMIT
+    assert len(idas(conexao, storage_db.save_clientes, clientes)) == 3 + len(clientes)
+
+
+def test_init_clientes_table(conexao):
+    # BEGIN + tabela/índices + função + trigger + COMMIT
+    assert len(idas(conexao, storage_db.init_clientes_table)) == 5
+
+
+def test_migrate_clientes_table(conexao):
+    conexao.respostas = {'information_schema.columns': (['column_name'], [('created_at',), ('updated_at',)])}
+    assert len(idas(conexao, storage_db.migrate_clientes_table)) == 3
+    conexao.respostas = {'information_schema.columns': (['column_name'], [])}
+    # Uma ida a mais por coluna adicionada
+    assert len(idas(conexao, storage_db.migrate_clientes_table)) == 5
+
+
+def test_iter_table_com_um_lote(conexao):
+    conexao.respostas = {'SELECT *': (['id', 'OS'], [(1, '1'), (2, '2'), (3, '3')])}
+    # Lote incompleto dispensa o FETCH vazio; o CLOSE vai antes do COMMIT
+    assert idas(conexao, storage_db.iter_table, 'os_cadastros') == [
+        'BEGIN', 'SELECT * FROM os_cadastros', 'FETCH', 'CLOSE', 'COMMIT',
+    ]
+    assert conexao.info.transaction_status == TRANSACTION_STATUS_IDLE
+
+
+def test_iter_table_com_lotes_cheios(conexao):
+    conexao.respostas = {'SELECT *': (['id'], [(1,), (2,), (3,), (4,)])}
+    assert idas(conexao, storage_db.iter_table, 'os_cadastros', 2) == [
+        'BEGIN', 'SELECT * FROM os_cadastros', 'FETCH', 'FETCH', 'FETCH', 'CLOSE', 'COMMIT',
+    ]
+
+
+def test_iter_table_interrompido_fecha_o_cursor(conexao):
+    conexao.respostas = {'SELECT *': (['id'], [(1,), (2,), (3,), (4,)])}
+    linhas = storage_db.iter_table('os_cadastros', 2)
+    next(linhas)
+    linhas.close()
+    # Sem COMMIT: a transação fica para o rollback do pool na devolução
+    assert conexao.idas == ['BEGIN', 'SELECT * FROM os_cadastros', 'FETCH', 'CLOSE']
+
+
+CASOS_INSTRUMENTADOS = LEITURAS + ESCRITAS + [
+    (storage_db.insert_usuarios_bulk, ([('a', 'h', 'A', 'tecnico'), ('b', 'h', 'B', 'tecnico')],)),
+    (storage_db.iter_table, ('os_cadastros', 2)),
+]
+
+
+@pytest.mark.parametrize('funcao,args', CASOS_INSTRUMENTADOS,
+                         ids=[_nome(c) for c in CASOS_INSTRUMENTADOS])
+def test_instrumentacao_confere_com_as_idas(conexao, funcao, args):
+    conexao.classe_cursor = CursorInstrumentadoFalso
+    conexao.respostas = dict(RESPOSTAS, **{'SELECT *': (['id'], [(1,), (2,), (3,)])})
+    with storage_db.contar_round_trips() as rt:
+        enviados = idas(conexao, funcao, *args)
+    assert rt.total == len(enviados)